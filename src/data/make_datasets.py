@@ -2,9 +2,10 @@ import os
 import click
 import pickle
 import logging
+import numpy as np
 from pathlib import Path
 from easydict import EasyDict
-from src.models.survtrace.dataset import load_data
+from src.models.survtrace.dataset import encode_data, split_data
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +14,51 @@ HORIZONS = [.25, .5, .75]
 DATASETS = ['metabric', 'support', 'seer']
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 DATA_DIR = os.path.join(ROOT_DIR, 'data','processed')
+# tables shared by every run of a dataset, see src.utils.data_class.Data
+ENCODED_DIR = 'encoded'
+META_FILE = 'meta.pickle'
+
+
+def save_block(directory: str, name: str, df, dtype, restore: bool = True) -> dict:
+    '''
+    Writes the columns of df as one {name}.npy array of dtype.
+
+    Args:
+        - restore (bool): read the columns back in the dtypes of df, else keep dtype
+
+    Returns:
+        description of the block: name, column names and the dtypes of the columns when read.
+    '''
+    np.save(os.path.join(directory, f'{name}.npy'), df.to_numpy(dtype=dtype))
+    dtypes = {col: str(t) if restore else str(np.dtype(dtype)) for col, t in df.dtypes.items()}
+    return {'name': name, 'columns': list(df.columns), 'dtypes': dtypes}
+
+
+def save_encoded(dataset_dir: str, df, df_feat, df_y, df_y_test, data_config: EasyDict):
+    '''
+    Writes the encoded tables of a dataset as .npy arrays that can be memory-mapped.
+
+    Categorical codes are stored in the smallest unsigned integer type holding the vocabulary
+    (uint8/uint16), numerical features as float32 and labels as float64. Features are read back in
+    their compact dtypes, labels in their original dtypes. Only the outcome columns of df are kept,
+    its raw features are already encoded in df_feat.
+    '''
+    encoded_dir = os.path.join(dataset_dir, ENCODED_DIR)
+    if not os.path.isdir(encoded_dir):
+        os.makedirs(encoded_dir)
+
+    num_cat = data_config.num_categorical_feature
+    cat_dtype = np.min_scalar_type(max(data_config.vocab_size - 1, 0))
+    df_outcomes = df.drop(columns=[col for col in df.columns if col in df_feat.columns])
+    tables = {
+        'features': [save_block(encoded_dir, 'x_cat', df_feat.iloc[:, :num_cat], cat_dtype, restore=False),
+                     save_block(encoded_dir, 'x_num', df_feat.iloc[:, num_cat:], 'float32', restore=False)],
+        'labels': [save_block(encoded_dir, 'y', df_y, 'float64')],
+        'labels_test': [save_block(encoded_dir, 'y_test', df_y_test, 'float64')],
+        'outcomes': [save_block(encoded_dir, 'outcomes', df_outcomes, 'float64')],
+    }
+    with open(os.path.join(encoded_dir, META_FILE), 'wb') as f:
+        pickle.dump({'tables': tables, 'config': data_config}, f)
 
 
 @click.command()
@@ -20,6 +66,9 @@ DATA_DIR = os.path.join(ROOT_DIR, 'data','processed')
 def make_data_run(num_runs):
     '''
     Clean datafile and split into training, validation, and test sets.
+
+    The features and labels are encoded once per dataset into a shared table,
+    each run only stores the positions of its training, validation, and test samples.
     '''
     for dataset in DATASETS:
         logger.info(f'Creating {dataset} data for {num_runs} runs')
@@ -35,12 +84,21 @@ def make_data_run(num_runs):
         if not os.path.isdir(dataset_dir):
             os.makedirs(dataset_dir)
 
+        # the encoding and the label cuts do not depend on the split
+        df, df_feat, df_y, df_y_test = encode_data(data_config)
+        save_encoded(dataset_dir, df, df_feat, df_y, df_y_test, data_config)
+
         for i in range(num_runs):
-            df, df_train, df_y_train, df_test, df_y_test, df_val, df_y_val = load_data(data_config)
+            index_train, index_val, index_test = split_data(df, df_feat)
+
+            # export split positions for run
+            np.savez(Path(dataset_dir, f'run_{i}.npz'), train=index_train.astype('int32'),
+                     val=index_val.astype('int32'), test=index_test.astype('int32'))
 
-            # export data for run as pickle file
-            with open(Path(dataset_dir, f'run_{i}.pickle'), 'wb') as f:
-                pickle.dump((df, df_train, df_y_train, df_test, df_y_test, df_val, df_y_val, data_config), f)
+            # a run pickled in the former format would hold stale splits
+            old_run_file = Path(dataset_dir, f'run_{i}.pickle')
+            if old_run_file.is_file():
+                old_run_file.unlink()
 
 def main():
     make_data_run()
@@ -10,7 +10,7 @@ RAW_DATA_PATH = os.path.join(ROOT_DIR, 'data', 'raw')
 PROCESSED_DATA_PATH = os.path.join(ROOT_DIR, 'data', 'processed')
 SEER_RAW_PATH = os.path.join(RAW_DATA_PATH, 'seer_raw.csv')
 SEER_FORMAT_PATH = os.path.join(PROCESSED_DATA_PATH, 'seer_format.csv')
-SEER_PROCESSED_PATH = os.path.join(PROCESSED_DATA_PATH, 'seer_processed.csv')
+SEER_PROCESSED_PATH = os.path.join(PROCESSED_DATA_PATH, 'seer_processed.feather')
 
 
 def main():
@@ -91,18 +91,20 @@ def main():
     logger.info(f'Wrote formatted SEER dataset to {SEER_FORMAT_PATH}')
 
     df = pd.read_csv(SEER_FORMAT_PATH)
+    # columnar output: categorical codes as the smallest unsigned integer type, numerical features as float32
     x_df_cat = {}
     for col in cat_cols:
-        x_df_cat[col] = LabelEncoder().fit_transform(df[col])
+        codes = LabelEncoder().fit_transform(df[col])
+        x_df_cat[col] = codes.astype(np.min_scalar_type(codes.max()))
     x_df_cat = pd.DataFrame(x_df_cat)
 
     x_num = StandardScaler().fit_transform(df[num_cols])
-    x_df_num = pd.DataFrame(x_num, columns=num_cols)
+    x_df_num = pd.DataFrame(x_num.astype('float32'), columns=num_cols)
 
     df = pd.concat([
         x_df_cat, x_df_num, df["duration"], df["event_heart"], df["event_breast"]
         ], axis=1)
-    df.to_csv(SEER_PROCESSED_PATH, index=False)
+    df.to_feather(SEER_PROCESSED_PATH)
     logger.info(f'Wrote processed SEER dataset to {SEER_PROCESSED_PATH}')
 
 if __name__ == '__main__':
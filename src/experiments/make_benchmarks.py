@@ -0,0 +1,541 @@
+# micro-benchmarks for the computational requirements of SurvTRACE on CPU.
+import io
+import copy
+import time
+import resource
+import multiprocessing
+import click
+import logging
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import torch
+from easydict import EasyDict
+
+from src.utils import configurations
+from src.utils.data_class import Data
+from src.utils.models import SurvTRACE
+from src.experiments.make_experiments import MODELS
+from src.models.survtrace import Evaluator
+from src.models.survtrace.modeling_bert import BertEncoder
+from src.models.survtrace.model import SurvTraceSingle, SurvTraceMulti
+from src.models.survtrace.export import export_torchscript
+from src.models.survtrace.inference import quantize_for_inference, tabulate_first_layer
+from src.models.survtrace.train_utils import BERTAdam, Trainer
+from src.models.survtrace.losses import nll_pc_hazard_loss, nll_pc_hazard_loss_fused
+from src.models.survtrace.losses import nll_logistic_hazard, nll_logistic_hazard_fused
+
+logger = logging.getLogger(__name__)
+
+DATASETS = ['metabric', 'support', 'seer']
+
+# SEER has 14 categorical and 4 numerical features after processing
+SEER_FEATURES = {
+    'num_feature': 18,
+    'num_categorical_feature': 14,
+    'num_numerical_feature': 4,
+}
+
+# SEER config and wider variants to see how the encoder scales
+ENCODER_SIZES = {
+    'seer': {},
+    'wide-64': {'hidden_size': 64, 'intermediate_size': 256, 'num_attention_heads': 4},
+    'wide-128': {'hidden_size': 128, 'intermediate_size': 512, 'num_attention_heads': 8},
+}
+
+
+def make_config(dataset_name: str='seer', **kwargs) -> EasyDict:
+    '''
+    Copies the SurvTRACE configuration of a dataset and overwrites entries with kwargs.
+
+    Args:
+        - dataset_name (str): one of ['metabric', 'support', 'seer']
+        - kwargs: configuration entries to overwrite
+
+    Returns:
+        configuration dictionary.
+    '''
+    config = copy.deepcopy(getattr(configurations, f'survtrace_{dataset_name}'))
+    if dataset_name == 'seer':
+        config.update(SEER_FEATURES)
+    config.update(kwargs)
+    return config
+
+
+def add_data_entries(config: EasyDict) -> EasyDict:
+    '''
+    Adds the configuration entries that are otherwise set by load_data.
+    '''
+    # EasyDict only keeps attributes in sync through item assignment
+    data_entries = {
+        'horizons': [.25, .5, .75],
+        'vocab_size': 8 * config.num_categorical_feature,
+        'duration_index': np.linspace(0, 1, config.out_feature + 1),
+    }
+    for key, value in data_entries.items():
+        if key not in config:
+            config[key] = value
+    return config
+
+
+def make_model(config: EasyDict, has_mtl: bool=True):
+    '''
+    Initializes a SurvTRACE model with random weights for the given configuration.
+
+    Args:
+        - config: configuration dictionary from make_config
+        - has_mtl (bool): add multi task learning heads
+
+    Returns:
+        SurvTraceMulti if config.num_event > 1 else SurvTraceSingle.
+    '''
+    add_data_entries(config)
+    if config.num_event > 1:
+        return SurvTraceMulti(config, has_mtl)
+    return SurvTraceSingle(config, has_mtl)
+
+
+def make_inputs(config: EasyDict, num_sample: int) -> torch.Tensor:
+    '''
+    Random features laid out as in load_data: categorical ids ahead of numerical features.
+    '''
+    x_cat = torch.randint(0, config.vocab_size, (num_sample, config.num_categorical_feature))
+    x_num = torch.randn(num_sample, config.num_numerical_feature)
+    return torch.cat([x_cat.double(), x_num.double()], dim=1)
+
+
+def make_labels(config: EasyDict, num_sample: int) -> torch.Tensor:
+    '''
+    Random labels packed as in utils.pack_labels: [num_sample, 3] or [num_sample, num_event, 3].
+    At most one event happens per sample.
+    '''
+    duration = torch.randint(0, config.out_feature, (num_sample,)).float()
+    event = torch.randint(0, config.num_event + 1, (num_sample,))    # 0 is censored
+    proportion = torch.rand(num_sample)
+    labels = torch.stack([torch.stack([duration, (event == risk + 1).float(), proportion], dim=1)
+        for risk in range(config.num_event)], dim=1)
+    return labels[:, 0] if config.num_event == 1 else labels
+
+
+def make_train_set(config: EasyDict, num_sample: int):
+    '''
+    Random training set in the (features, df_y) layout of Trainer.fit, features as a (x_cat, x_num) pair.
+    '''
+    x_input = make_inputs(config, num_sample)
+    x_cat, x_num = x_input[:, :config.num_categorical_feature].long(), x_input[:, config.num_categorical_feature:].float()
+    labels = make_labels(config, num_sample)
+    if config.num_event == 1:
+        df_y = pd.DataFrame(labels.numpy(), columns=['duration', 'event', 'proportion'])
+    else:
+        df_y = pd.DataFrame(labels[:, 0].numpy(), columns=['duration', 'event_0', 'proportion'])
+        for risk in range(1, config.num_event):
+            df_y[f'event_{risk}'] = labels[:, risk, 1].numpy()
+    return (x_cat.numpy(), x_num.numpy()), df_y
+
+
+def time_fn(fn: Callable, repeats: int=20, warmup: int=3) -> float:
+    '''
+    Times fn and returns the median seconds per call after a few warmup calls.
+    '''
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def model_size_mb(model: torch.nn.Module) -> float:
+    '''
+    Size of the serialized state dict in MB.
+    '''
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1e6
+
+
+def train_survtrace(dataset_name: str, run_num: int, model_name: str='survtrace', **kwargs):
+    '''
+    Trains a SurvTRACE variant on a data run as in make_experiments.run_experiment.
+
+    Args:
+        - kwargs: configuration entries to overwrite
+
+    Returns:
+        - Tuple
+            - Tuple[0]: config
+            - Tuple[1]: Data class from utils.data_class
+            - Tuple[2]: trained SurvTRACE class from utils.models
+            - Tuple[3]: training time in seconds
+    '''
+    config = copy.deepcopy(getattr(configurations, f'survtrace_{dataset_name}'))
+    config.model = model_name
+    config.update(kwargs)
+    data = Data(config, dataset=dataset_name, run_num=run_num)
+    m = SurvTRACE(config)
+    train_time_start = time.perf_counter()
+    m.train(data)
+    return config, data, m, time.perf_counter() - train_time_start
+
+
+def _predict_peak_memory(lean: bool, num_sample: int, queue):
+    '''
+    Scores num_sample samples in one forward, as EvaluatorSingle does, and puts
+    the increase of peak resident memory in MB and the latency in seconds on queue.
+    Runs in a fresh process so the peak memory of each path is measured separately.
+    '''
+    torch.manual_seed(0)
+    config = make_config('seer')
+    model = make_model(config).eval()
+    x_input = make_inputs(config, num_sample)
+    # converted once before timing, so both paths score the same tensors
+    x_cat, x_num = x_input[:, :config.num_categorical_feature].long(), x_input[:, config.num_categorical_feature:].float()
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    with torch.no_grad():
+        if lean:
+            model.predict((x_cat, x_num), batch_size=None)
+        else:
+            model(x_cat, x_num)[1]
+    latency = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(((peak - baseline) / 1024, latency))
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--batch_size', default=1024, type=int, help='Number of samples per forward')
+@click.option('--repeats', default=20, type=int, help='Number of timed forwards')
+def attention(batch_size, repeats):
+    '''
+    CPU throughput of the eager and fused self-attention in BertEncoder.
+
+    The fused encoder loads the state dict of the eager encoder, so outputs
+    are also compared to check that checkpoints stay compatible.
+    '''
+    for size_name, size in ENCODER_SIZES.items():
+        config = make_config('seer', **size)
+        eager = BertEncoder(make_config('seer', use_fused_attention=False, **size)).eval()
+        fused = BertEncoder(make_config('seer', use_fused_attention=True, **size)).eval()
+        fused.load_state_dict(eager.state_dict())
+
+        hidden_states = torch.randn(batch_size, config.num_feature, config.hidden_size)
+        with torch.no_grad():
+            max_diff = (eager(hidden_states)[0] - fused(hidden_states)[0]).abs().max().item()
+            eager_time = time_fn(lambda: eager(hidden_states), repeats)
+            fused_time = time_fn(lambda: fused(hidden_states), repeats)
+
+        logger.info(f'{size_name}: eager {batch_size / eager_time:,.0f} samples/s, '
+                    f'fused {batch_size / fused_time:,.0f} samples/s, '
+                    f'speedup {eager_time / fused_time:.2f}x, max abs diff {max_diff:.2e}')
+
+
+@cli.command()
+@click.option('--num_sample', default=4096, type=int, help='Number of samples to check')
+def export(num_sample):
+    '''
+    Parity of the TorchScript export with predict_surv for single and competing events.
+    '''
+    for num_event in [1, 2]:
+        config = make_config('seer', num_event=num_event)
+        model = make_model(config)
+        x_input = make_inputs(config, num_sample)
+        # raises if the exported survival differs from predict_surv
+        module = export_torchscript(model, x_check=x_input)
+
+        x_cat, x_num = x_input[:, :config.num_categorical_feature].long(), x_input[:, config.num_categorical_feature:].float()
+        with torch.no_grad():
+            eager_time = time_fn(lambda: model.predict_surv(x_input))
+            export_time = time_fn(lambda: module(x_cat, x_num))
+        logger.info(f'num_event={num_event}: parity ok, predict_surv {eager_time*1e3:.1f} ms, '
+                    f'torchscript {export_time*1e3:.1f} ms')
+
+
+@cli.command()
+@click.option('--num_runs', default=1, type=int, help='Number of data runs to train and evaluate')
+def quantization(num_runs):
+    '''
+    C-index, Brier score, latency and size of int8 dynamically quantized SurvTRACE against fp32 on CPU.
+    '''
+    rows = []
+    for dataset_name in DATASETS:
+        for i in range(num_runs):
+            config, data, m, _ = train_survtrace(dataset_name, i)
+            model_fp32 = m.model.cpu().eval()
+            model_fp32.use_gpu = False
+            model_int8 = quantize_for_inference(model_fp32)
+
+            evaluator = Evaluator(data.df, data.df_train.index)
+            val_batch_size = config.get('val_batch_size')
+            for precision, model in [('fp32', model_fp32), ('int8', model_int8)]:
+                run = dict(evaluator.eval(model, (data.df_test, data.df_y_test), val_batch_size=val_batch_size))
+                run['latency_s'] = time_fn(lambda: model.predict_surv(data.df_test, batch_size=val_batch_size), repeats=5, warmup=1)
+                run['size_mb'] = model_size_mb(model)
+                rows.append({'dataset': dataset_name, 'precision': precision, **run})
+
+    report = pd.DataFrame(rows).groupby(['dataset', 'precision']).mean().transpose()
+    logger.info('\n' + report.to_string())
+
+
+@cli.command()
+@click.option('--repeats', default=20, type=int, help='Number of timed predictions')
+def tables(repeats):
+    '''
+    Latency of the first layer projection tables on SEER-sized batches.
+    '''
+    config = make_config('seer', num_event=2)
+    model = make_model(config).eval()
+    model_tables = tabulate_first_layer(model)
+    for batch_size in [config.batch_size, config.val_batch_size]:
+        x_input = make_inputs(config, batch_size)
+        with torch.no_grad():
+            max_diff = (model.predict(x_input, event=None) - model_tables.predict(x_input, event=None)).abs().max().item()
+            dense_time = time_fn(lambda: model.predict(x_input, event=None), repeats)
+            tables_time = time_fn(lambda: model_tables.predict(x_input, event=None), repeats)
+        logger.info(f'batch_size={batch_size}: dense {dense_time*1e3:.1f} ms, tables {tables_time*1e3:.1f} ms, '
+                    f'speedup {dense_time / tables_time:.2f}x, max abs diff {max_diff:.2e}')
+
+
+@cli.command()
+@click.option('--num_sample', default=150000, type=int, help='Number of test samples, scored in one forward')
+def lean(num_sample):
+    '''
+    Peak memory and latency of scoring a full test set with the training forward and with inference_forward.
+    '''
+    ctx = multiprocessing.get_context('spawn')
+    for name, is_lean in [('forward', False), ('inference_forward', True)]:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_predict_peak_memory, args=(is_lean, num_sample, queue))
+        process.start()
+        peak_mb, latency = queue.get()
+        process.join()
+        logger.info(f'{name}: peak memory +{peak_mb:,.0f} MB, latency {latency:.2f} s')
+
+
+@cli.command()
+@click.option('--num_event', default=2, type=int, help='Number of competing events')
+@click.option('--repeats', default=50, type=int, help='Number of timed steps')
+def step(num_event, repeats):
+    '''
+    Time per training step (forward, loss, backward, BERTAdam.step) of each SurvTRACE variant,
+    eager and through torch.compile when available.
+    '''
+    variants = [model_name for model_name in MODELS if model_name.startswith('survtrace')]
+    modes = [False, True] if hasattr(torch, 'compile') else [False]
+    for model_name in variants:
+        for compile_step in modes:
+            config = add_data_entries(make_config('seer', num_event=num_event, model=model_name,
+                                                  data='seer' if num_event > 1 else 'metabric',
+                                                  compile_step=compile_step))
+            m = SurvTRACE(config)
+            model = m.model.train()
+            optimizer = BERTAdam(model.parameters(), config.learning_rate)
+            x_input = make_inputs(config, config.batch_size)
+            x_cat, x_num = x_input[:, :config.num_categorical_feature].long(), x_input[:, config.num_categorical_feature:].float()
+            y = make_labels(config, config.batch_size)
+
+            def train_step():
+                optimizer.zero_grad()
+                m.trainer.step_fn(x_cat, x_num, y).backward()
+                optimizer.step()
+
+            step_time = time_fn(train_step, repeats)
+            logger.info(f'{model_name} ({"compiled" if compile_step else "eager"}): {step_time*1e3:.2f} ms/step')
+
+
+@cli.command()
+@click.option('--max_event', default=8, type=int, help='Largest number of competing events')
+@click.option('--repeats', default=50, type=int, help='Number of timed steps')
+def events(max_event, repeats):
+    '''
+    Time per training step of survtrace (PC-Hazard loss) and survtrace-woIPS (logistic-hazard loss)
+    on SEER with 1, 2, 4, ... competing events, with the survival loss of all events in one stacked
+    call and with one call per event, and the difference between both losses.
+    '''
+    for model_name in ['survtrace', 'survtrace-woIPS']:
+        num_event = 1
+        while num_event <= max_event:
+            events_step(model_name, num_event, repeats)
+            num_event *= 2
+
+
+def events_step(model_name: str, num_event: int, repeats: int):
+    '''
+    Times a training step of model_name with the stacked and the per event survival loss.
+    '''
+    config = add_data_entries(make_config('seer', num_event=num_event, model=model_name,
+                                          data='seer' if num_event > 1 else 'metabric'))
+    m = SurvTRACE(config)
+    model = m.model.train()
+    optimizer = BERTAdam(model.parameters(), config.learning_rate)
+    x_input = make_inputs(config, config.batch_size)
+    x_cat, x_num = x_input[:, :config.num_categorical_feature].long(), x_input[:, config.num_categorical_feature:].float()
+    y = make_labels(config, config.batch_size)
+    training_step = m.trainer.training_step
+
+    # same logits through both loss paths, dropout is off so both see the same outputs
+    model.eval()
+    with torch.no_grad():
+        phi = training_step.model_forward(x_cat, x_num)
+        losses = {}
+        for stacked in [True, False]:
+            training_step.stacked_events = stacked
+            losses[stacked] = training_step.loss(phi, y).item()
+    model.train()
+
+    def train_step():
+        optimizer.zero_grad()
+        m.trainer.step_fn(x_cat, x_num, y).backward()
+        optimizer.step()
+
+    times = {}
+    for stacked in [True, False]:
+        training_step.stacked_events = stacked
+        times[stacked] = time_fn(train_step, repeats)
+    logger.info(f'{model_name} num_event={num_event}: stacked {times[True]*1e3:.2f} ms/step, '
+                f'per event {times[False]*1e3:.2f} ms/step, '
+                f'loss abs diff {abs(losses[True] - losses[False]):.2e}')
+
+
+@cli.command()
+@click.option('--repeats', default=200, type=int, help='Number of timed optimizer steps')
+def optimizer(repeats):
+    '''
+    Time per BERTAdam.step of the parameter loop and the foreach update on the SEER model,
+    with per tensor and global gradient clipping.
+    '''
+    torch.manual_seed(0)
+    model = make_model(make_config('seer', num_event=2))
+    grads = [torch.randn_like(p) for p in model.parameters()]
+    results = {}
+    for clip_mode in ['per_tensor', 'global']:
+        for foreach in [False, True]:
+            model_copy = copy.deepcopy(model)
+            optimizer = BERTAdam(model_copy.parameters(), 1e-4, clip_mode=clip_mode, foreach=foreach)
+            for p, grad in zip(model_copy.parameters(), grads):
+                p.grad = grad.clone()
+
+            def step():
+                # the clipping scales the gradients in place
+                for p, grad in zip(model_copy.parameters(), grads):
+                    p.grad.copy_(grad)
+                optimizer.step()
+
+            step_time = time_fn(step, repeats)
+            results[clip_mode, foreach] = torch.cat([p.detach().flatten() for p in model_copy.parameters()])
+            logger.info(f'{clip_mode} {"foreach" if optimizer.foreach else "loop"}: {step_time*1e6:.0f} us/step')
+        max_diff = (results[clip_mode, False] - results[clip_mode, True]).abs().max().item()
+        logger.info(f'{clip_mode}: max abs diff between loop and foreach parameters {max_diff:.2e}')
+
+
+@cli.command()
+@click.option('--num_runs', default=1, type=int, help='Number of data runs to train and evaluate')
+def precision(num_runs):
+    '''
+    Time per epoch and C-index of SurvTRACE trained and evaluated with bfloat16 autocast against fp32 on CPU.
+    '''
+    rows = []
+    for dataset_name in DATASETS:
+        for i in range(num_runs):
+            for precision_name in ['fp32', 'bf16']:
+                # reseed so both precisions start from the same weights and batches
+                np.random.seed(i)
+                torch.manual_seed(i)
+                config, data, m, train_time = train_survtrace(dataset_name, i, precision=precision_name)
+                evaluator = Evaluator(data.df, data.df_train.index)
+                run = dict(evaluator.eval(m.model, (data.df_test, data.df_y_test), val_batch_size=config.get('val_batch_size')))
+                run['time_per_epoch'] = train_time / m.epochs_trained
+                rows.append({'dataset': dataset_name, 'precision': precision_name, **run})
+
+    report = pd.DataFrame(rows).groupby(['dataset', 'precision']).mean().transpose()
+    logger.info('\n' + report.to_string())
+
+
+@cli.command()
+@click.option('--num_sample', default=200000, type=int, help='Number of training samples')
+@click.option('--epochs', default=2, type=int, help='Number of training epochs')
+@click.option('--max_workers', default=4, type=int, help='Largest number of data-parallel workers')
+def distributed(num_sample, epochs, max_workers):
+    '''
+    Time per epoch of SurvTRACE on a SEER-sized training set with 1, 2, 4, ... data-parallel gloo workers.
+    '''
+    config = make_config('seer', num_event=2)
+    train_set = make_train_set(config, num_sample)
+    world_size = 1
+    while world_size <= max_workers:
+        model = make_model(config, has_mtl=False)
+        trainer = Trainer(model, metrics=None, world_size=world_size)
+        train_time_start = time.perf_counter()
+        trainer.fit(train_set, batch_size=config.batch_size, epochs=epochs, learning_rate=config.learning_rate)
+        time_per_epoch = (time.perf_counter() - train_time_start) / epochs
+        logger.info(f'world_size={world_size}: {time_per_epoch:.2f} s/epoch')
+        world_size *= 2
+
+
+@cli.command()
+@click.option('--batch_size', default=1024, type=int, help='Number of samples per loss call')
+@click.option('--repeats', default=200, type=int, help='Number of timed forward and backward passes')
+def pchazard(batch_size, repeats):
+    '''
+    Time per forward and backward of the reference and the fused PC-Hazard loss.
+    The analytic backward of the fused loss is checked in tests/test_losses.py.
+    '''
+    torch.manual_seed(0)
+    for out_feature in [make_config('seer').out_feature, 50, 200]:
+        config = make_config('seer', out_feature=out_feature)
+        labels = make_labels(config, batch_size)
+        phi = torch.randn(batch_size, out_feature, requires_grad=True)
+        times = {}
+        for loss_name, loss_fn in [('reference', nll_pc_hazard_loss), ('fused', nll_pc_hazard_loss_fused)]:
+            def step():
+                phi.grad = None
+                loss_fn(phi, labels[:, 0].long(), labels[:, 1].long(), labels[:, 2]).backward()
+            times[loss_name] = time_fn(step, repeats)
+        logger.info(f'out_feature={out_feature}: reference {times["reference"]*1e6:.0f} us, '
+                    f'fused {times["fused"]*1e6:.0f} us, speedup {times["reference"] / times["fused"]:.2f}x')
+
+
+@cli.command()
+@click.option('--batch_size', default=1024, type=int, help='Number of samples per loss call')
+@click.option('--repeats', default=200, type=int, help='Number of timed forward and backward passes')
+def loghazard(batch_size, repeats):
+    '''
+    Time per forward and backward of the reference and the closed form logistic-hazard loss
+    (the survtrace-woIPS* variants) as the number of durations grows, with their loss and gradient differences.
+    '''
+    torch.manual_seed(0)
+    for out_feature in [make_config('seer').out_feature, 50, 200]:
+        config = make_config('seer', out_feature=out_feature)
+        labels = make_labels(config, batch_size)
+        phi = torch.randn(batch_size, out_feature, requires_grad=True)
+        times, results = {}, {}
+        for loss_name, loss_fn in [('reference', nll_logistic_hazard), ('fused', nll_logistic_hazard_fused)]:
+            def step():
+                phi.grad = None
+                loss = loss_fn(phi, labels[:, 0].long(), labels[:, 1].long())
+                loss.backward()
+                return loss
+            times[loss_name] = time_fn(step, repeats)
+            results[loss_name] = (step().detach(), phi.grad.clone())
+        max_diff = max((results['reference'][k] - results['fused'][k]).abs().max().item() for k in range(2))
+        logger.info(f'out_feature={out_feature}: reference {times["reference"]*1e6:.0f} us, '
+                    f'fused {times["fused"]*1e6:.0f} us, speedup {times["reference"] / times["fused"]:.2f}x, '
+                    f'max abs diff {max_diff:.2e}')
+
+
+def main():
+    cli()
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    main()
@@ -132,7 +132,7 @@ def run_experiment(dataset_name: str, model_name: str, num_runs=10, event_to_cen
         evaluator = Evaluator(data, m, config)
         try:
             run = evaluator.eval()
-            run = update_run(run, train_time_start, train_time_finish, m.epochs_trained)
+            run = update_run(run, train_time_start, train_time_finish, m.epochs_trained, m.phase_times)
             runs_list.append(run)
         except ValueError as e:
             logger.error(f'ERROR: Could not evaluate {model_name} on {dataset_name} data for run {i}. Skipping.')
@@ -1,5 +1,26 @@
 from easydict import EasyDict
 
+# training and inference options shared by every dataset, merged into STConfig and the survtrace configs
+TRAINING_OPTIONS = {
+    'use_fused_attention': False, # use F.scaled_dot_product_attention in self-attention, needs torch>=2.0
+    'compile_step': False, # run the training step through torch.compile, needs torch>=2.0
+    'grad_clip_mode': 'per_tensor', # BERTAdam gradient clipping: 'per_tensor' (original) or 'global'
+    'foreach_optimizer': True, # BERTAdam updates all parameters with multi-tensor kernels
+    'precision': 'fp32', # 'bf16' trains and predicts with bfloat16 autocast, needs torch>=1.10
+    'world_size': 1, # number of data-parallel cpu training processes (torch.distributed gloo)
+    'keep_best_in_memory': True, # early stopping keeps the best weights in memory instead of torch.save to 'checkpoint'
+    'async_checkpoint': False, # with keep_best_in_memory, also write the best weights in a background thread to a per-run path
+    'resume_every': 0, # write the full training state every resume_every epochs for Trainer.fit(resume_from=...), 0 disables
+    'resume_checkpoint': None, # path of the training state, default: '{checkpoint}-{model}-{data}-run{i}-resume.pt'
+    'val_every': 1, # validate every val_every epochs, early_stop_patience counts validation checks
+    'val_every_steps': 0, # if > 0, validate every val_every_steps optimizer steps instead
+    'val_subsample': None, # validate on a fixed random subsample, a fraction (< 1) or a number of samples
+    'val_confidence': 0.95, # confidence level of the band printed with the subsampled validation loss
+    'phase_timers': False, # record the seconds of each training phase per epoch, see train_utils.PHASES, syncs cuda around each phase
+    'profile': None, # torch.profiler over training steps, True or a schedule such as {'wait': 1, 'warmup': 1, 'active': 3, 'repeat': 1}
+    'profile_dir': None, # chrome traces and top operator tables of the profiler, default: '<repo>/results/profiles'
+}
+
 STConfig = EasyDict(
     {
         'data': 'metabric', # dataset name, in 'metabric', 'support', or 'seer'
@@ -29,5 +50,6 @@ STConfig = EasyDict(
         'output_hidden_states': False, # no use 
         'tie_word_embeddings': True, # no use
         'pruned_heads': {}, # no use
+        **TRAINING_OPTIONS,
     }
 )
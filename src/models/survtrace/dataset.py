@@ -8,10 +8,18 @@ import os
 from .utils import LabelTransform
 
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
-SEER_DATA = os.path.join(ROOT_DIR, 'data', 'processed', 'seer_processed.csv')
-
-def load_data(config):
-    '''load data, return updated configuration.
+SEER_DATA = os.path.join(ROOT_DIR, 'data', 'processed', 'seer_processed.feather')
+
+def encode_data(config):
+    '''encode the features and discretize the labels of the full dataset, update the configuration.
+    Nothing here depends on the train/val/test split (the scaler and label encoders are fit on the full
+    dataset and the cuts are quantiles of the full dataset), so it only needs to run once per dataset.
+
+    Returns:
+        df -- the raw dataset, with the discretized events for SEER.
+        df_feat -- categorical codes ahead of standardized numerical features.
+        df_y -- discretized labels (duration index, event(s), proportion) for training and validation.
+        df_y_test -- labels on the original time scale for testing.
     '''
     data = config['data']
     horizons = config['horizons']
@@ -41,21 +49,12 @@ def load_data(config):
             df_feat[feat] = LabelEncoder().fit_transform(df_feat[feat]).astype(float) + vocab_size
             vocab_size = df_feat[feat].max() + 1
 
-        # get the largest duraiton time
-        max_duration_idx = df["duration"].argmax()
-        df_test = df_feat.drop(max_duration_idx).sample(frac=0.3)
-        df_train = df_feat.drop(df_test.index)
-        df_val = df_train.drop(max_duration_idx).sample(frac=0.1)
-        df_train = df_train.drop(df_val.index)
-
         # assign cuts
         labtrans = LabelTransform(cuts=np.array([df["duration"].min()]+times+[df["duration"].max()]))
-        labtrans.fit(*get_target(df.loc[df_train.index]))
+        labtrans.fit(*get_target(df))
         y = labtrans.transform(*get_target(df)) # y = (discrete duration, event indicator)
-        df_y_train = pd.DataFrame({"duration": y[0][df_train.index], "event": y[1][df_train.index], "proportion": y[2][df_train.index]}, index=df_train.index)
-        df_y_val = pd.DataFrame({"duration": y[0][df_val.index], "event": y[1][df_val.index],  "proportion": y[2][df_val.index]}, index=df_val.index)
-        # df_y_test = pd.DataFrame({"duration": y[0][df_test.index], "event": y[1][df_test.index],  "proportion": y[2][df_test.index]}, index=df_test.index)
-        df_y_test = pd.DataFrame({"duration": df['duration'].loc[df_test.index], "event": df['event'].loc[df_test.index]})
+        df_y = pd.DataFrame({"duration": y[0], "event": y[1], "proportion": y[2]}, index=df.index)
+        df_y_test = pd.DataFrame({"duration": df['duration'], "event": df['event']})
 
     elif data == "support":
         df = support.read_df()
@@ -75,29 +74,20 @@ def load_data(config):
             df_feat[feat] = LabelEncoder().fit_transform(df_feat[feat]).astype(float) + vocab_size
             vocab_size = df_feat[feat].max() + 1
 
-        # get the largest duraiton time
-        max_duration_idx = df["duration"].argmax()
-        df_test = df_feat.drop(max_duration_idx).sample(frac=0.3)
-        df_train = df_feat.drop(df_test.index)
-        df_val = df_train.drop(max_duration_idx).sample(frac=0.1)
-        df_train = df_train.drop(df_val.index)
-
         # assign cuts
         # labtrans = LabTransDiscreteTime(cuts=np.array([0]+times+[df["duration"].max()]))
         labtrans = LabelTransform(cuts=np.array([0]+times+[df["duration"].max()]))
 
-        labtrans.fit(*get_target(df.loc[df_train.index]))
+        labtrans.fit(*get_target(df))
         # y = labtrans.fit_transform(*get_target(df)) # y = (discrete duration, event indicator)
         y = labtrans.transform(*get_target(df)) # y = (discrete duration, event indicator)
-        df_y_train = pd.DataFrame({"duration": y[0][df_train.index], "event": y[1][df_train.index], "proportion":y[2][df_train.index]}, index=df_train.index)
-        df_y_val = pd.DataFrame({"duration": y[0][df_val.index], "event": y[1][df_val.index], "proportion":y[2][df_val.index]}, index=df_val.index)
-        # df_y_test = pd.DataFrame({"duration": y[0][df_test.index], "event": y[1][df_test.index], "proportion":y[2][df_test.index]}, index=df_test.index)
-        df_y_test = pd.DataFrame({"duration": df['duration'].loc[df_test.index], "event": df['event'].loc[df_test.index]})
+        df_y = pd.DataFrame({"duration": y[0], "event": y[1], "proportion":y[2]}, index=df.index)
+        df_y_test = pd.DataFrame({"duration": df['duration'], "event": df['event']})
 
 
     # TODO: for cause-specfic analysis, may need to make quantiles based on each event separately
     elif data == "seer":
-        df = pd.read_csv(SEER_DATA)
+        df = pd.read_feather(SEER_DATA)
 
         times = np.quantile(df["duration"][df['event_breast']==1.0], horizons).tolist()
         event_list = ["event_breast", "event_heart"]
@@ -122,45 +112,31 @@ def load_data(config):
             df_feat[feat] = LabelEncoder().fit_transform(df_feat[feat]).astype(float) + vocab_size
             vocab_size = df_feat[feat].max() + 1
 
-        # get the largest duraiton time
-        max_duration_idx = df["duration"].argmax()
-        df_test = df_feat.drop(max_duration_idx).sample(frac=0.3)
-        df_train = df_feat.drop(df_test.index)
-        df_val = df_train.drop(max_duration_idx).sample(frac=0.1)
-        df_train = df_train.drop(df_val.index)
-
         # assign cuts
         labtrans = LabelTransform(cuts=np.array([0]+times+[df["duration"].max()]))
         get_target = lambda df,event: (df['duration'].values, df[event].values)
 
         # this datasets have two competing events!
-        df_y_train = pd.DataFrame({"duration":df["duration"][df_train.index]})
-        df_y_test = pd.DataFrame({"duration":df["duration"][df_test.index]})
-        df_y_val = pd.DataFrame({"duration":df["duration"][df_val.index]})
+        df_y = pd.DataFrame({"duration":df["duration"]})
 
         for i,event in enumerate(event_list):
-            labtrans.fit(*get_target(df.loc[df_train.index], event))
+            labtrans.fit(*get_target(df, event))
             y = labtrans.transform(*get_target(df, event)) # y = (discrete duration, event indicator)
 
             event_name = "event_{}".format(i)
             df[event_name] = y[1]
-            df_y_train[event_name] = df[event_name][df_train.index]
-            df_y_val[event_name] = df[event_name][df_val.index]
-            df_y_test[event_name] = df[event_name][df_test.index]
+            df_y[event_name] = df[event_name]
 
         # discretized duration
         df["duration_disc"] = y[0]
 
         # proportion is the same for all events
         df["proportion"] = y[2]
+        df_y["proportion"] = df["proportion"]
 
-        df_y_train["proportion"] = df["proportion"][df_train.index]
-        df_y_val["proportion"] = df["proportion"][df_val.index]
-        df_y_test["proportion"] = df["proportion"][df_test.index]
-
-        df_y_train["duration"] = df["duration_disc"][df_train.index]
-        df_y_val["duration"] = df["duration_disc"][df_val.index]
-        df_y_test["duration"] = df["duration"][df_test.index]
+        # the test labels keep the original durations
+        df_y_test = df_y.copy()
+        df_y["duration"] = df["duration_disc"]
 
         # set number of events
         config['num_event'] = 2
@@ -168,8 +144,30 @@ def load_data(config):
     config['labtrans'] = labtrans
     config['num_numerical_feature'] = int(len(cols_standardize))
     config['num_categorical_feature'] = int(len(cols_categorical))
-    config['num_feature'] = int(len(df_train.columns))
+    config['num_feature'] = int(len(df_feat.columns))
     config['vocab_size'] = int(vocab_size)
     config['duration_index'] = labtrans.cuts
     config['out_feature'] = int(labtrans.out_features)
-    return df, df_train, df_y_train, df_test, df_y_test, df_val, df_y_val
\ No newline at end of file
+    return df, df_feat, df_y, df_y_test
+
+def split_data(df, df_feat):
+    '''random train/val/test split, the sample with the largest duration is kept in the training set.
+
+    Returns:
+        positions of the train, val and test samples in `df_feat`, in the order they were sampled.
+    '''
+    # get the largest duraiton time
+    max_duration_idx = df["duration"].argmax()
+    df_test = df_feat.drop(max_duration_idx).sample(frac=0.3)
+    df_train = df_feat.drop(df_test.index)
+    df_val = df_train.drop(max_duration_idx).sample(frac=0.1)
+    df_train = df_train.drop(df_val.index)
+    return tuple(df_feat.index.get_indexer(split.index) for split in (df_train, df_val, df_test))
+
+def load_data(config):
+    '''load data, return updated configuration.
+    '''
+    df, df_feat, df_y, df_y_test = encode_data(config)
+    index_train, index_val, index_test = split_data(df, df_feat)
+    return (df, df_feat.iloc[index_train], df_y.iloc[index_train], df_feat.iloc[index_test], df_y_test.iloc[index_test],
+            df_feat.iloc[index_val], df_y.iloc[index_val])
\ No newline at end of file
@@ -55,11 +55,12 @@ class Evaluator:
         df_test, df_y_test = test_set
 
         metric_dict = defaultdict(list)
+        surv_all = model.predict_surv_all(df_test, batch_size=val_batch_size)
         for risk_idx in range(model.config.num_event):
             durations_train, events_train = get_target(df_train_all, risk_idx)
             durations_test, events_test = get_target(df_y_test, risk_idx)
             
-            surv = model.predict_surv(df_test, batch_size=val_batch_size, event=risk_idx)
+            surv = surv_all[:, risk_idx]
             risk = 1 - surv
 
             et_train = np.array([(events_train[i], durations_train[i]) for i in range(len(events_train))],
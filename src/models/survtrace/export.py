@@ -0,0 +1,90 @@
+'''export trained survtrace models to TorchScript for inference.
+
+The exported artifact only needs `torch` to be loaded:
+
+    module = torch.jit.load('survtrace.ts')
+    hazard, surv = module(x_cat, x_num)
+    module.duration_index
+'''
+import copy
+import numpy as np
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from .modeling_bert import BertCLSMulti
+from .utils import to_model_inputs
+
+
+class SurvTraceInference(nn.Module):
+    '''inference-only survtrace, takes (x_cat, x_num) and returns (hazard, surv) on `duration_index`.
+    The single/competing events branching is resolved when the module is built, and the
+    multi-task learning heads are dropped as they are not used for prediction.
+    For competing events the outputs are [num_sample, num_event, len(duration_index)].
+    '''
+    def __init__(self, model):
+        super().__init__()
+        self.embeddings = copy.deepcopy(model.embeddings)
+        self.encoder = copy.deepcopy(model.encoder)
+        self.cls = copy.deepcopy(model.cls)
+        self.multi_event = isinstance(model.cls, BertCLSMulti)
+        self.register_buffer('duration_index', torch.as_tensor(np.asarray(model.duration_index, dtype='float32')))
+
+    def forward(self, x_cat, x_num):
+        embedding_output = self.embeddings(input_ids=x_cat, input_x_num=x_num)
+        sequence_output = self.encoder(embedding_output, output_hidden_states=False)[0]
+        if self.multi_event:
+            logits = self.cls(sequence_output, event=None)
+        else:
+            logits = self.cls(sequence_output)
+        hazard = F.pad(F.softplus(logits), (1, 0))
+        surv = hazard.cumsum(-1).mul(-1).exp()
+        return hazard, surv
+
+
+def check_parity(model, module, x_input):
+    '''max absolute difference between the survival of `module` and `model.predict_surv` on x_input.
+    '''
+    x_cat, x_num = to_model_inputs(x_input, model.config.num_categorical_feature)
+    with torch.no_grad():
+        _, surv = module(x_cat, x_num)
+    if isinstance(model.cls, BertCLSMulti):
+        surv_model = torch.stack([model.predict_surv(x_input, event=event).cpu()
+            for event in range(model.config.num_event)], dim=1)
+    else:
+        surv_model = model.predict_surv(x_input).cpu()
+    return (surv - surv_model).abs().max().item()
+
+
+def export_torchscript(model, path=None, x_check=None, atol=1e-5):
+    '''turn a trained SurvTraceSingle or SurvTraceMulti into a traced TorchScript module.
+    The encoder relies on python-level helpers (e.g. `apply_chunking_to_forward`) that
+    `torch.jit.script` cannot compile, tracing records the resolved inference graph instead.
+
+    Arguments:
+        model -- trained survtrace model.
+        path {str} -- if given, the module is saved there with `torch.jit.save`.
+        x_check {pd.DataFrame, torch.tensor, tuple} -- if given, the exported survival is checked
+            against `model.predict_surv` on these samples.
+        atol {float} -- tolerance of the parity check.
+
+    Returns:
+        torch.jit.ScriptModule -- the exported module.
+    '''
+    model = copy.deepcopy(model).cpu().eval()
+    model.use_gpu = False
+    module = SurvTraceInference(model).eval()
+
+    x_cat = torch.zeros(2, model.config.num_categorical_feature, dtype=torch.long)
+    x_num = torch.zeros(2, model.config.num_numerical_feature)
+    with torch.no_grad():
+        exported = torch.jit.trace(module, (x_cat, x_num))
+
+    if x_check is not None:
+        max_diff = check_parity(model, exported, x_check)
+        if max_diff > atol:
+            raise ValueError(f"Exported module differs from `predict_surv` by {max_diff:.2e} > {atol:.2e}")
+
+    if path is not None:
+        torch.jit.save(exported, path)
+    return exported
@@ -0,0 +1,93 @@
+'''inference-time optimizations of trained survtrace models on CPU.
+All passes return an optimized copy and leave the trained model untouched.
+'''
+import copy
+import torch
+from torch import nn
+
+from .modeling_bert import BertCLS, BertCLSMulti, BertProjectionTables
+
+
+def quantize_for_inference(model, dtype=torch.qint8):
+    '''int8 dynamically quantized copy of a SurvTraceSingle or SurvTraceMulti for CPU scoring.
+    Weights of every `nn.Linear` (attention, intermediate/output dense layers and the cls heads)
+    are stored in int8 and activations are quantized on the fly, embeddings, LayerNorm and
+    BatchNorm stay in float32. The copy keeps the `predict*` API of the model.
+
+    Arguments:
+        model -- trained survtrace model.
+        dtype {torch.dtype} -- quantized weight dtype (default: {torch.qint8})
+
+    Returns:
+        the quantized model in eval mode on cpu.
+    '''
+    model = copy.deepcopy(model).cpu().eval()
+    model.use_gpu = False
+    return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=dtype)
+
+
+def _fold_batch_norm_into_linear(batch_norm, linear):
+    '''fold `batch_norm` (eval mode) into the `linear` layer that consumes its output.
+    BN(x) = x * scale + shift, so W BN(x) + b = (W * scale) x + (W shift + b).
+    '''
+    scale = torch.rsqrt(batch_norm.running_var + batch_norm.eps)
+    shift = -batch_norm.running_mean * scale
+    if batch_norm.affine:
+        scale = scale * batch_norm.weight
+        shift = shift * batch_norm.weight + batch_norm.bias
+    with torch.no_grad():
+        if linear.bias is None:
+            linear.bias = nn.Parameter(torch.zeros(linear.out_features, device=linear.weight.device))
+        linear.bias.add_(linear.weight @ shift)
+        linear.weight.mul_(scale)
+
+
+def fold_batch_norm(model):
+    '''eval-only copy of a survtrace model with the BatchNorm of the cls heads folded away.
+    `DenseVanillaBlock` runs Linear -> ReLU -> BatchNorm1d, as the BatchNorm comes after
+    the activation it is folded into the following `nn.Linear` (the output layer of
+    `BertCLS`/`BertCLSEvent`/`BertCLSTime`, every event output layer of `BertCLSMulti`).
+    Dropout modules, which are no-ops in eval mode, are replaced by `nn.Identity`.
+    The copy must not be switched back to training.
+
+    Arguments:
+        model -- trained survtrace model.
+
+    Returns:
+        the folded model in eval mode.
+    '''
+    model = copy.deepcopy(model).eval()
+    for module in list(model.modules()):
+        if isinstance(module, BertCLS):
+            block, next_linears = module.net[0], [module.net[1]]
+        elif isinstance(module, BertCLSMulti):
+            block, next_linears = module.net[0], list(module.net_out)
+        else:
+            continue
+        if block.batch_norm is not None:
+            for linear in next_linears:
+                _fold_batch_norm_into_linear(block.batch_norm, linear)
+            block.batch_norm = None
+
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.Dropout):
+                setattr(module, name, nn.Identity())
+    return model
+
+
+def tabulate_first_layer(model):
+    '''eval-only copy of a survtrace model whose first layer query/key/value come from lookup tables.
+    Categorical tokens gather their projections from per-vocabulary tables and numerical tokens
+    use a per-feature scale and bias, instead of three dense matmuls over all tokens.
+    The tables are built from the current weights, so the copy must not be trained.
+
+    Arguments:
+        model -- trained survtrace model.
+
+    Returns:
+        the tabulated model in eval mode.
+    '''
+    model = copy.deepcopy(model).eval()
+    model.projection_tables = BertProjectionTables(model.embeddings, model.encoder.layer[0].attention.self)
+    return model
@@ -29,12 +29,26 @@ class NLLLogistiHazardLoss(_Loss):
             'none': No reduction.
             'mean': Mean of tensor.
             'sum: sum.
+        fused {bool} -- Use the closed form `nll_logistic_hazard_fused`, else the
+            reference `nll_logistic_hazard`. (default: {True})
+
+    Competing events are passed stacked, `phi` [batch, num_event, T] with [batch, num_event] labels,
+    the loss of a sample is the sum of the loss of its events.
     
     Returns:
         torch.tensor -- The negative log-likelihood.
     """
+    supports_stacked_events = True
+
+    def __init__(self, reduction: str = 'mean', fused: bool = True) -> None:
+        super().__init__(reduction)
+        self.fused = fused
+
     def forward(self, phi: Tensor, idx_durations: Tensor, events: Tensor, reduction: str = 'mean') -> Tensor:
-        
+        if self.fused:
+            return nll_logistic_hazard_fused(phi, idx_durations, events, reduction)
+        if phi.dim() == 3:
+            return _sum_over_events(nll_logistic_hazard, phi, idx_durations, events, reduction=reduction)
         return nll_logistic_hazard(phi, idx_durations, events, reduction)
 
 def _reduction(loss: Tensor, reduction: str = 'mean') -> Tensor:
@@ -46,6 +60,12 @@ def _reduction(loss: Tensor, reduction: str = 'mean') -> Tensor:
         return loss.sum()
     raise ValueError(f"`reduction` = {reduction} is not valid. Use 'none', 'mean' or 'sum'.")
 
+def _sum_over_events(loss_fn, phi: Tensor, *labels: Tensor, reduction: str = 'mean') -> Tensor:
+    """`loss_fn` of stacked logits [batch, num_event, T] with one call per event, summed over the events."""
+    loss = sum(loss_fn(phi[:, event], *(label[:, event] for label in labels), reduction='none')
+               for event in range(phi.shape[1]))
+    return _reduction(loss, reduction)
+
 def nll_logistic_hazard(phi: Tensor, idx_durations: Tensor, events: Tensor,
                         reduction: str = 'mean') -> Tensor:
     """Negative log-likelihood of the discrete time hazard parametrized model LogisticHazard [1].
@@ -74,6 +94,9 @@ def nll_logistic_hazard(phi: Tensor, idx_durations: Tensor, events: Tensor,
                          f" but got `phi.shape[1] = {phi.shape[1]}`")
     if events.dtype is torch.bool:
         events = events.float()
+    # logits from bfloat16 autocast, the loss is computed in float32
+    if phi.dtype in (torch.float16, torch.bfloat16):
+        phi = phi.float()
     events = events.view(-1, 1)
     idx_durations = idx_durations.view(-1, 1)
 
@@ -82,8 +105,52 @@ def nll_logistic_hazard(phi: Tensor, idx_durations: Tensor, events: Tensor,
     loss = bce.cumsum(1).gather(1, idx_durations).view(-1)
     return _reduction(loss, reduction)
 
+def nll_logistic_hazard_fused(phi: Tensor, idx_durations: Tensor, events: Tensor,
+                              reduction: str = 'mean') -> Tensor:
+    """Same loss as `nll_logistic_hazard` in closed form, without the dense target matrix.
+    With BCE(phi, y) = softplus(phi) - y * phi and -log(1 - sigmoid(phi)) = softplus(phi),
+    the target is 1 only at the duration index d of an event, so
+        loss = sum_{j<=d} softplus(phi_j) - events * phi_d
+    i.e. the prefix of -log(1 - sigmoid) up to d plus one gathered event term.
+    Stacked logits [batch, num_event, T] with [batch, num_event] labels return the sum over events per sample.
+    """
+    if phi.shape[-1] <= idx_durations.max():
+        raise ValueError(f"Network output `phi` is too small for `idx_durations`."+
+                         f" Need at least `phi.shape[-1] = {idx_durations.max().item()+1}`,"+
+                         f" but got `phi.shape[-1] = {phi.shape[-1]}`")
+    # logits from bfloat16 autocast, the loss is computed in float32
+    if phi.dtype in (torch.float16, torch.bfloat16):
+        phi = phi.float()
+    num_sample, stacked = phi.shape[0], phi.dim() == 3
+    phi = phi.reshape(-1, phi.shape[-1])
+    events = events.to(phi.dtype).reshape(-1)
+    idx_durations = idx_durations.reshape(-1, 1)
+
+    after = torch.arange(phi.shape[1], device=phi.device).view(1, -1) > idx_durations
+    prefix = F.softplus(phi).masked_fill(after, 0.).sum(1)
+    loss = prefix - events * phi.gather(1, idx_durations).view(-1)
+    if stacked:
+        loss = loss.view(num_sample, -1).sum(1)
+    return _reduction(loss, reduction)
+
 #### PCH Loss ####
 class NLLPCHazardLoss(_Loss):
+    """Negative log-likelihood of the PC-Hazard parametrization model.
+
+    Arguments:
+        reduction {string} -- How to reduce the loss.
+        fused {bool} -- Use `nll_pc_hazard_loss_fused` (single pass, analytic backward),
+            else the reference `nll_pc_hazard_loss`. (default: {True})
+
+    Competing events are passed stacked, `phi` [batch, num_event, T] with [batch, num_event] labels,
+    the loss of a sample is the sum of the loss of its events.
+    """
+    supports_stacked_events = True
+
+    def __init__(self, reduction: str = 'mean', fused: bool = True) -> None:
+        super().__init__(reduction)
+        self.fused = fused
+
     def forward(self, phi: Tensor, idx_durations: Tensor, events: Tensor, interval_frac: Tensor,
                 reduction: str = 'mean') -> Tensor:
         """Negative log-likelihood of the PC-Hazard parametrization model.
@@ -98,6 +165,10 @@ class NLLPCHazardLoss(_Loss):
         Returns:
             torch.tensor -- The negative log-likelihood loss.
         """
+        if self.fused:
+            return nll_pc_hazard_loss_fused(phi, idx_durations, events, interval_frac, reduction)
+        if phi.dim() == 3:
+            return _sum_over_events(nll_pc_hazard_loss, phi, idx_durations, events, interval_frac, reduction=reduction)
         return nll_pc_hazard_loss(phi, idx_durations, events, interval_frac, reduction)
 
 def log_softplus(input, threshold=-15.):
@@ -141,6 +212,9 @@ def nll_pc_hazard_loss(phi: Tensor, idx_durations: Tensor, events: Tensor, inter
     """
     if events.dtype is torch.bool:
         events = events.float()
+    # logits from bfloat16 autocast, log_softplus and cumsum are computed in float32
+    if phi.dtype in (torch.float16, torch.bfloat16):
+        phi = phi.float()
     idx_durations = idx_durations.view(-1, 1)
     events = events.view(-1)
     interval_frac = interval_frac.view(-1)
@@ -157,4 +231,66 @@ def nll_pc_hazard_loss(phi: Tensor, idx_durations: Tensor, events: Tensor, inter
     haz = pad_col(haz, where='start')
     sum_haz = haz.cumsum(1).gather(1, idx_durations).view(-1) 
     loss = - log_h_e.sub(scaled_h_e).sub(sum_haz)
-    return _reduction(loss, reduction)
\ No newline at end of file
+    return _reduction(loss, reduction)
+
+
+class _PCHazardNLL(torch.autograd.Function):
+    """Per sample PC-Hazard negative log-likelihood with an analytic backward.
+
+    With h = softplus(phi), d the duration index, f the interval fraction and e the event:
+        loss = sum_{j<d} h_j + f * h_d - e * log(h_d)
+    so the first two terms are one weighted row sum of h, and
+        dloss/dphi_j = w_j * sigmoid(phi_j) - [j == d] * e * dlog(h_d)/dphi_d
+    with w_j = 1 for j < d, f for j = d and 0 after. Below `threshold` log(h_d) is replaced by phi_d
+    (see `log_softplus`), whose derivative is 1.
+    """
+    @staticmethod
+    def _weights(phi, idx_durations, interval_frac):
+        grid = torch.arange(phi.shape[1], device=phi.device).view(1, -1)
+        return (grid < idx_durations).to(phi.dtype) + (grid == idx_durations).to(phi.dtype) * interval_frac.view(-1, 1)
+
+    @staticmethod
+    def forward(ctx, phi, idx_durations, events, interval_frac, threshold):
+        haz = F.softplus(phi)
+        phi_e = phi.gather(1, idx_durations).view(-1)
+        log_h_e = torch.where(phi_e >= threshold, haz.gather(1, idx_durations).view(-1).log(), phi_e)
+        loss = haz.mul_(_PCHazardNLL._weights(phi, idx_durations, interval_frac)).sum(1) - events * log_h_e
+        ctx.save_for_backward(phi, idx_durations, events, interval_frac)
+        ctx.threshold = threshold
+        return loss
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        phi, idx_durations, events, interval_frac = ctx.saved_tensors
+        grad = torch.sigmoid(phi)
+        phi_e = phi.gather(1, idx_durations).view(-1)
+        sig_e = grad.gather(1, idx_durations).view(-1)
+        dlog_h_e = torch.where(phi_e >= ctx.threshold, sig_e / F.softplus(phi_e), torch.ones_like(phi_e))
+        grad.mul_(_PCHazardNLL._weights(phi, idx_durations, interval_frac))
+        grad.scatter_add_(1, idx_durations, events.mul(dlog_h_e).neg_().view(-1, 1))
+        grad.mul_(grad_output.view(-1, 1))
+        return grad, None, None, None, None
+
+def nll_pc_hazard_loss_fused(phi: Tensor, idx_durations: Tensor, events: Tensor, interval_frac: Tensor,
+                             reduction: str = 'mean', threshold: float = -15.) -> Tensor:
+    """Same loss as `nll_pc_hazard_loss`, computed in one pass over `phi` with a hand-written backward.
+    softplus is evaluated once, the log hazard is selected with `torch.where` and the cumulative
+    hazard is a masked row sum, so no mask indexing of `phi`, padded copy or full `cumsum` is needed.
+    Samples with negative `idx_durations` are dropped from the loss as in `nll_pc_hazard_loss`.
+    Stacked logits [batch, num_event, T] with [batch, num_event] labels return the sum over events
+    per sample, where events with negative `idx_durations` count as 0.
+    """
+    if events.dtype is not phi.dtype:
+        events = events.to(phi.dtype)
+    # logits from bfloat16 autocast, the loss is computed in float32
+    if phi.dtype in (torch.float16, torch.bfloat16):
+        phi, events = phi.float(), events.float()
+    num_sample, stacked = phi.shape[0], phi.dim() == 3
+    phi = phi.reshape(-1, phi.shape[-1])
+    idx_durations = idx_durations.reshape(-1, 1)
+    keep = idx_durations.view(-1) >= 0
+    loss = _PCHazardNLL.apply(phi, idx_durations.clamp(min=0), events.reshape(-1),
+                              interval_frac.reshape(-1).to(phi.dtype), threshold)
+    if stacked:
+        return _reduction(loss.masked_fill(~keep, 0.).view(num_sample, -1).sum(1), reduction)
+    return _reduction(loss[keep], reduction)
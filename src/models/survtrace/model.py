@@ -8,9 +8,43 @@ import torchtuples as tt
 import pdb
 import torch.nn.functional as F
 from .modeling_bert import BaseModel, BertEmbeddings, BertEncoder, BertCLS, BertCLSEvent, BertCLSTime, BertCLSMulti
-from .utils import pad_col
+from .utils import pad_col, to_model_inputs, autocast
+from .profiling import start_profiler, DEFAULT_PROFILE_DIR
 from .config import STConfig
 
+# memory budget in bytes of the activations of one forward when predicting with batch_size='auto'
+DEFAULT_MAX_MEMORY = 2 ** 30
+
+def auto_batch_size(config, num_sample, max_memory=None):
+    '''number of samples per forward such that the activations of a forward fit in `max_memory` bytes.
+    The peak is inside a BertLayer: the [heads, F, F] attention scores and probabilities, the
+    [F, hidden_size] query/key/value/context/outputs and the [F, intermediate_size] feed forward.
+    '''
+    if max_memory is None:
+        max_memory = DEFAULT_MAX_MEMORY
+    num_feature = config.num_feature
+    per_sample = 2 * config.num_attention_heads * num_feature * num_feature \
+        + 8 * num_feature * config.hidden_size \
+        + 2 * num_feature * config.intermediate_size
+    # float32 activations, doubled for the temporaries of elementwise ops
+    per_sample_bytes = 2 * 4 * per_sample
+    return int(max(1, min(num_sample, max_memory // per_sample_bytes)))
+
+def predict_in_batches(forward_fn, x_cat, x_num, batch_size, on_batch_end=None):
+    '''run `forward_fn` over batches of (x_cat, x_num) and stream the outputs into one preallocated tensor.
+    `on_batch_end` is called after each batch, e.g. to step a profiler.
+    '''
+    num_sample = len(x_num)
+    preds = None
+    for start in range(0, num_sample, batch_size):
+        batch_pred = forward_fn(x_cat[start:start+batch_size], x_num[start:start+batch_size])
+        if preds is None:
+            preds = batch_pred.new_empty((num_sample,) + batch_pred.shape[1:])
+        preds[start:start+batch_size] = batch_pred
+        if on_batch_end is not None:
+            on_batch_end()
+    return preds
+
 class SurvTraceMulti(BaseModel):
     '''SurvTRACE model for competing events survival analysis.
     '''
@@ -20,9 +54,11 @@ class SurvTraceMulti(BaseModel):
         self.encoder = BertEncoder(config)
         self.cls = BertCLSMulti(config)
         self.config = config
+        self.projection_tables = None # set by inference.tabulate_first_layer
         self.init_weights()
         self.duration_index = config['duration_index']
         self.use_gpu = False
+        self.precision = getattr(config, 'precision', 'fp32') # mixed precision policy of predict, 'fp32' or 'bf16'
 
         # mutli task learning nets
         self.has_mtl = has_mtl
@@ -60,7 +96,7 @@ class SurvTraceMulti(BaseModel):
         inputs_embeds=None,
         output_attentions=None,
         output_hidden_states=None,
-        event=0, # output the prediction for different competing events
+        event=0, # output the prediction for different competing events, None outputs all events at once
     ):
         output_attentions = output_attentions if output_attentions is not None else self.config.output_attentions
         output_hidden_states = (
@@ -91,7 +127,12 @@ class SurvTraceMulti(BaseModel):
             inputs_embeds=inputs_embeds,
         )
 
-        encoder_outputs = self.encoder(embedding_output)
+        # first layer query/key/value from lookup tables instead of dense projections
+        first_layer_mixed_layers = None
+        if self.projection_tables is not None and input_ids is not None:
+            first_layer_mixed_layers = self.projection_tables(input_ids, input_nums)
+
+        encoder_outputs = self.encoder(embedding_output, first_layer_mixed_layers=first_layer_mixed_layers)
         sequence_output = encoder_outputs[0]
         
         predict_logits = self.cls(sequence_output, event=event)
@@ -109,36 +150,50 @@ class SurvTraceMulti(BaseModel):
         else:
             return sequence_output, predict_logits
 
+    def inference_forward(self, input_ids, input_nums, event=0, output_mtl=False):
+        '''inference-only forward, skips the hidden states of all layers, head and attention masks.
+        Returns the logits, and the outputs of the MTL heads if `output_mtl`.
+        '''
+        embedding_output = self.embeddings(input_ids=input_ids, input_x_num=input_nums)
+        first_layer_mixed_layers = None
+        if self.projection_tables is not None:
+            first_layer_mixed_layers = self.projection_tables(input_ids, input_nums)
+        sequence_output = self.encoder(
+            embedding_output, output_hidden_states=False, first_layer_mixed_layers=first_layer_mixed_layers,
+        )[0]
+        predict_logits = self.cls(sequence_output, event=event)
+        if output_mtl and self.has_mtl:
+            return predict_logits, self.cls_event(sequence_output), self.cls_time(sequence_output)
+        return predict_logits
+
+    def predict(self, x_input, batch_size=None, event=0, max_memory=None, profile=None):
+        '''logits of `event` for x_input, a dataframe or tensor of features or a (x_cat, x_num) pair.
+        batch_size=None runs a single forward, batch_size='auto' (or passing `max_memory` in bytes)
+        picks the batch size such that the activations of a forward stay within the memory budget.
+        profile=True records the whole prediction with torch.profiler, a dict schedule (see
+        `profiling.make_profiler`) records a window of batches, exported under config.profile_dir.
+        '''
+        x_cat, x_num = to_model_inputs(x_input, self.config.num_categorical_feature)
 
-    def predict(self, x_input, batch_size=None, event=0):
-        if not isinstance(x_input, torch.Tensor):
-            x_input_cat = x_input.iloc[:, :self.config.num_categorical_feature]
-            x_input_num = x_input.iloc[:, self.config.num_categorical_feature:]
-            x_num = torch.tensor(x_input_num.values).float()
-            x_cat = torch.tensor(x_input_cat.values).long()
-        else:
-            x_cat = x_input[:, :self.config.num_categorical_feature].long()
-            x_num = x_input[:, self.config.num_categorical_feature:].float()
-        
         if self.use_gpu:
             x_num = x_num.cuda()
             x_cat = x_cat.cuda()
 
         num_sample = len(x_num)
+        if batch_size == 'auto' or max_memory is not None:
+            batch_size = auto_batch_size(self.config, num_sample, max_memory)
         self.eval()
-        with torch.no_grad():
+        profiler = start_profiler('predict', profile, getattr(self.config, 'profile_dir', DEFAULT_PROFILE_DIR))
+        with torch.no_grad(), autocast(self.precision, x_num.device.type):
             if batch_size is None:
-                    preds = self.forward(x_cat, x_num, event=event)[1]
+                    preds = self.inference_forward(x_cat, x_num, event=event)
             else:
-                preds = []
-                num_batch = int(np.ceil(num_sample / batch_size))
-                for idx in range(num_batch):
-                    batch_x_num = x_num[idx*batch_size:(idx+1)*batch_size]
-                    batch_x_cat = x_cat[idx*batch_size:(idx+1)*batch_size]
-                    batch_pred = self.forward(batch_x_cat, batch_x_num,event=event)
-                    preds.append(batch_pred[1])
-                preds = torch.cat(preds)
-        return preds
+                preds = predict_in_batches(
+                    lambda batch_x_cat, batch_x_num: self.inference_forward(batch_x_cat, batch_x_num, event=event),
+                    x_cat, x_num, batch_size, on_batch_end=profiler.step,
+                )
+        profiler.stop()
+        return preds.float()
 
     def predict_hazard(self, input_ids, batch_size=None, event=0):
         preds = self.predict(input_ids, batch_size, event=event)
@@ -159,6 +214,48 @@ class SurvTraceMulti(BaseModel):
         surv = self.predict_surv(input_ids, batch_size, event=event)
         return pd.DataFrame(surv.to("cpu").numpy().T, self.duration_index)
 
+    def predict_hazard_all(self, input_ids, batch_size=None):
+        '''hazard of all events from one encoder pass, [num_sample, num_event, len(duration_index)].
+        '''
+        preds = self.predict(input_ids, batch_size, event=None)
+        hazard = F.softplus(preds)
+        hazard = F.pad(hazard, (1, 0))
+        return hazard
+
+    def predict_surv_all(self, input_ids, batch_size=None):
+        '''cause-specific survival of all events, equals `predict_surv` stacked over events.
+        '''
+        hazard = self.predict_hazard_all(input_ids, batch_size)
+        surv = hazard.cumsum(-1).mul(-1).exp()
+        return surv
+
+    def predict_cif(self, input_ids, batch_size=None, event=0):
+        '''cumulative incidence of `event`, [num_sample, len(duration_index)]. It depends on the hazards
+        of every event, one encoder pass each; `predict_cif_all` gets all events from a single pass.
+        '''
+        hazards = [self.predict_hazard(input_ids, batch_size, event=e) for e in range(self.config.num_event)]
+        hazard_total = sum(hazards)
+        surv_total = hazard_total.cumsum(1).mul(-1).exp()
+        surv_prev = pad_col(surv_total[:, :-1], val=1, where="start")
+        prob_interval = surv_prev * (1 - hazard_total.mul(-1).exp())
+        frac = hazards[event] / torch.where(hazard_total > 0, hazard_total, torch.ones_like(hazard_total))
+        cif = (prob_interval * frac).cumsum(1)
+        return cif
+
+    def predict_cif_all(self, input_ids, batch_size=None):
+        '''cumulative incidence of all events, [num_sample, num_event, len(duration_index)].
+        The hazards are piecewise constant, so the probability of failing in an interval
+        is split between the events in proportion to their hazards in that interval.
+        '''
+        hazard = self.predict_hazard_all(input_ids, batch_size)
+        hazard_total = hazard.sum(1)
+        surv_total = hazard_total.cumsum(-1).mul(-1).exp()
+        surv_prev = F.pad(surv_total[:, :-1], (1, 0), value=1.)
+        prob_interval = surv_prev * (1 - hazard_total.mul(-1).exp())
+        frac = hazard / torch.where(hazard_total > 0, hazard_total, torch.ones_like(hazard_total)).unsqueeze(1)
+        cif = (prob_interval.unsqueeze(1) * frac).cumsum(-1)
+        return cif
+
 
 class SurvTraceSingle(BaseModel):
     '''survtrace used for single event survival analysis
@@ -169,9 +266,11 @@ class SurvTraceSingle(BaseModel):
         self.encoder = BertEncoder(config)
         self.cls = BertCLS(config)
         self.config = config
+        self.projection_tables = None # set by inference.tabulate_first_layer
         self.init_weights()
         self.duration_index = config['duration_index']
         self.use_gpu = False
+        self.precision = getattr(config, 'precision', 'fp32') # mixed precision policy of predict, 'fp32' or 'bf16'
 
         # mutli task learning nets
         self.has_mtl = has_mtl
@@ -259,7 +358,12 @@ class SurvTraceSingle(BaseModel):
             inputs_embeds=inputs_embeds,
         )
 
-        encoder_outputs = self.encoder(embedding_output)
+        # first layer query/key/value from lookup tables instead of dense projections
+        first_layer_mixed_layers = None
+        if self.projection_tables is not None and input_ids is not None:
+            first_layer_mixed_layers = self.projection_tables(input_ids, input_nums)
+
+        encoder_outputs = self.encoder(embedding_output, first_layer_mixed_layers=first_layer_mixed_layers)
         sequence_output = encoder_outputs[1]
         
         # do pooling
@@ -280,36 +384,48 @@ class SurvTraceSingle(BaseModel):
         else:
             return sequence_output, predict_logits
 
-            
-    def predict(self, x_input, batch_size=None):
-        if not isinstance(x_input, torch.Tensor):
-            x_input_cat = x_input.iloc[:, :self.config.num_categorical_feature]
-            x_input_num = x_input.iloc[:, self.config.num_categorical_feature:]
-            x_num = torch.tensor(x_input_num.values).float()
-            x_cat = torch.tensor(x_input_cat.values).long()
-        else:
-            x_cat = x_input[:, :self.config.num_categorical_feature].long()
-            x_num = x_input[:, self.config.num_categorical_feature:].float()
-        
+    def inference_forward(self, input_ids, input_nums, output_mtl=False):
+        '''inference-only forward, skips the hidden states of all layers, head and attention masks.
+        Returns the logits, and the outputs of the MTL heads if `output_mtl`.
+        '''
+        embedding_output = self.embeddings(input_ids=input_ids, input_x_num=input_nums)
+        first_layer_mixed_layers = None
+        if self.projection_tables is not None:
+            first_layer_mixed_layers = self.projection_tables(input_ids, input_nums)
+        sequence_output = self.encoder(
+            embedding_output, output_hidden_states=False, first_layer_mixed_layers=first_layer_mixed_layers,
+        )[0]
+        predict_logits = self.cls(sequence_output)
+        if output_mtl and self.has_mtl:
+            return predict_logits, self.cls_event(sequence_output), self.cls_time(sequence_output)
+        return predict_logits
+
+    def predict(self, x_input, batch_size=None, max_memory=None, profile=None):
+        '''logits for x_input, a dataframe or tensor of features or a (x_cat, x_num) pair.
+        batch_size=None runs a single forward, batch_size='auto' (or passing `max_memory` in bytes)
+        picks the batch size such that the activations of a forward stay within the memory budget.
+        profile=True records the whole prediction with torch.profiler, a dict schedule (see
+        `profiling.make_profiler`) records a window of batches, exported under config.profile_dir.
+        '''
+        x_cat, x_num = to_model_inputs(x_input, self.config.num_categorical_feature)
+
         if self.use_gpu:
             x_num = x_num.cuda()
             x_cat = x_cat.cuda()
 
         num_sample = len(x_num)
+        if batch_size == 'auto' or max_memory is not None:
+            batch_size = auto_batch_size(self.config, num_sample, max_memory)
         self.eval()
-        with torch.no_grad():
+        profiler = start_profiler('predict', profile, getattr(self.config, 'profile_dir', DEFAULT_PROFILE_DIR))
+        with torch.no_grad(), autocast(self.precision, x_num.device.type):
             if batch_size is None:
-                    preds = self.forward(x_cat, x_num)[1]
+                    preds = self.inference_forward(x_cat, x_num)
             else:
-                preds = []
-                num_batch = int(np.ceil(num_sample / batch_size))
-                for idx in range(num_batch):
-                    batch_x_num = x_num[idx*batch_size:(idx+1)*batch_size]
-                    batch_x_cat = x_cat[idx*batch_size:(idx+1)*batch_size]
-                    batch_pred = self.forward(batch_x_cat,batch_x_num)
-                    preds.append(batch_pred[1])
-                preds = torch.cat(preds)
-        return preds
+                preds = predict_in_batches(self.inference_forward, x_cat, x_num, batch_size,
+                                           on_batch_end=profiler.step)
+        profiler.stop()
+        return preds.float()
 
     def predict_hazard(self, input_ids, batch_size=None):
         preds = self.predict(input_ids, batch_size)
@@ -11,6 +11,7 @@ from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 import inspect
 import torch.nn.functional as F
 from .config import STConfig
+from .utils import fp32_region, autocast_enabled
 
 class BaseModel(nn.Module):
     def __init__(self, config: STConfig, *inputs, **kwargs):
@@ -206,6 +207,14 @@ class BaseModel(nn.Module):
             )
 
 
+class FP32LayerNorm(nn.LayerNorm):
+    """LayerNorm always computed in float32, also for bfloat16 activations under autocast."""
+    def forward(self, input):
+        if not autocast_enabled(input.device.type):
+            return super().forward(input)
+        with fp32_region(input.device.type):
+            return F.layer_norm(input.float(), self.normalized_shape, self.weight, self.bias, self.eps)
+
 class BertEmbeddings(nn.Module):
     """Construct the embeddings from word, position and token_type embeddings."""
 
@@ -217,7 +226,7 @@ class BertEmbeddings(nn.Module):
 
         # self.LayerNorm is not snake-cased to stick with TensorFlow model variable name and be able to load
         # any TensorFlow checkpoint file
-        self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
+        self.LayerNorm = FP32LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
     def forward(
@@ -232,6 +241,36 @@ class BertEmbeddings(nn.Module):
         # embeddings = self.LayerNorm(embeddings)
         return embeddings
 
+class BertProjectionTables(nn.Module):
+    """Query, key and value projections of the first BertLayer as lookup tables, for inference only.
+
+    There are no position embeddings, so the projection of a categorical token only depends on its
+    vocabulary id, and the projection of a numerical token `x * num_embeddings` is `x * scale + bias`.
+    The tables are computed from the current weights and must be rebuilt if the weights change.
+    """
+
+    def __init__(self, embeddings, self_attention):
+        super().__init__()
+        linears = [self_attention.query, self_attention.key, self_attention.value]
+        with torch.no_grad():
+            word_embeddings = embeddings.word_embeddings.weight
+            num_embeddings = embeddings.num_embeddings[0]
+            # [3, vocab_size, all_head_size]
+            self.register_buffer("cat_tables", torch.stack([F.linear(word_embeddings, l.weight, l.bias) for l in linears]), persistent=False)
+            # [3, num_numerical_feature, all_head_size]
+            self.register_buffer("num_scales", torch.stack([F.linear(num_embeddings, l.weight) for l in linears]), persistent=False)
+            # [3, all_head_size]
+            self.register_buffer("num_biases", torch.stack([l.bias for l in linears]), persistent=False)
+
+    def forward(self, input_ids, input_x_num):
+        num_layers = torch.addcmul(
+            self.num_biases[:, None, None, :], input_x_num[None, :, :, None], self.num_scales[:, None, :, :]
+        )
+        cat_layers = self.cat_tables[:, input_ids]
+        # same token order as BertEmbeddings: numerical features ahead of categorical features
+        mixed_layers = torch.cat([num_layers, cat_layers], dim=2)
+        return mixed_layers.unbind(0)
+
 class BertSelfAttention(nn.Module):
     def __init__(self, config):
         super().__init__()
@@ -255,6 +294,13 @@ class BertSelfAttention(nn.Module):
             self.max_position_embeddings = config.max_position_embeddings
             self.distance_embedding = nn.Embedding(2 * config.max_position_embeddings - 1, self.attention_head_size)
 
+        # fused attention needs torch>=2.0, otherwise fall back to the eager implementation
+        self.use_fused_attention = (
+            getattr(config, "use_fused_attention", False)
+            and hasattr(F, "scaled_dot_product_attention")
+            and self.position_embedding_type == "absolute"
+        )
+
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
         x = x.view(*new_x_shape)
@@ -269,8 +315,19 @@ class BertSelfAttention(nn.Module):
         encoder_attention_mask=None,
         past_key_value=None,
         output_attentions=False,
+        mixed_layers=None,
     ):
-        mixed_query_layer = self.query(hidden_states)
+        if (
+            self.use_fused_attention
+            and encoder_hidden_states is None
+            and past_key_value is None
+            and head_mask is None
+            and not output_attentions
+        ):
+            return self.fused_forward(hidden_states, attention_mask, mixed_layers)
+
+        # query, key and value projections may be precomputed from the inputs, see BertProjectionTables
+        mixed_query_layer = self.query(hidden_states) if mixed_layers is None else mixed_layers[0]
 
         # If this is instantiated as a cross-attention module, the keys
         # and values come from an encoder; the attention mask needs to be
@@ -291,6 +348,9 @@ class BertSelfAttention(nn.Module):
             value_layer = self.transpose_for_scores(self.value(hidden_states))
             key_layer = torch.cat([past_key_value[0], key_layer], dim=2)
             value_layer = torch.cat([past_key_value[1], value_layer], dim=2)
+        elif mixed_layers is not None:
+            key_layer = self.transpose_for_scores(mixed_layers[1])
+            value_layer = self.transpose_for_scores(mixed_layers[2])
         else:
             key_layer = self.transpose_for_scores(self.key(hidden_states))
             value_layer = self.transpose_for_scores(self.value(hidden_states))
@@ -322,7 +382,7 @@ class BertSelfAttention(nn.Module):
             attention_scores = attention_scores + attention_mask
 
         # Normalize the attention scores to probabilities.
-        attention_probs = nn.Softmax(dim=-1)(attention_scores)
+        attention_probs = F.softmax(attention_scores, dim=-1)
 
         # This is actually dropping out entire tokens to attend to, which might
         # seem a bit unusual, but is taken from the original Transformer paper.
@@ -343,11 +403,28 @@ class BertSelfAttention(nn.Module):
 
         return outputs
 
+    def fused_forward(self, hidden_states, attention_mask=None, mixed_layers=None):
+        """Encoder-only self-attention on top of `F.scaled_dot_product_attention`.
+        Uses the same query/key/value layers, so checkpoints are shared with the eager path.
+        """
+        batch_size, seq_length, _ = hidden_states.size()
+        if mixed_layers is None:
+            mixed_layers = (self.query(hidden_states), self.key(hidden_states), self.value(hidden_states))
+        query_layer, key_layer, value_layer = [self.transpose_for_scores(layer) for layer in mixed_layers]
+
+        dropout_p = self.dropout.p if self.training else 0.0
+        context_layer = F.scaled_dot_product_attention(
+            query_layer, key_layer, value_layer, attn_mask=attention_mask, dropout_p=dropout_p,
+        )
+
+        context_layer = context_layer.transpose(1, 2).reshape(batch_size, seq_length, self.all_head_size)
+        return (context_layer,)
+
 class BertSelfOutput(nn.Module):
     def __init__(self, config):
         super().__init__()
         self.dense = nn.Linear(config.hidden_size, config.hidden_size)
-        self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
+        self.LayerNorm = FP32LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
     def forward(self, hidden_states, input_tensor):
@@ -390,6 +467,7 @@ class BertAttention(nn.Module):
         encoder_attention_mask=None,
         past_key_value=None,
         output_attentions=False,
+        mixed_layers=None,
     ):
         self_outputs = self.self(
             hidden_states,
@@ -399,6 +477,7 @@ class BertAttention(nn.Module):
             encoder_attention_mask,
             past_key_value,
             output_attentions,
+            mixed_layers,
         )
         attention_output = self.output(self_outputs[0], hidden_states)
         outputs = (attention_output,) + self_outputs[1:]  # add attentions if we output them
@@ -428,7 +507,7 @@ class BertOutput(nn.Module):
     def __init__(self, config):
         super().__init__()
         self.dense = nn.Linear(config.intermediate_size, config.hidden_size)
-        self.LayerNorm = nn.LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
+        self.LayerNorm = FP32LayerNorm(config.hidden_size, eps=config.layer_norm_eps)
         self.dropout = nn.Dropout(config.hidden_dropout_prob)
 
     def forward(self, hidden_states, input_tensor):
@@ -456,6 +535,7 @@ class BertLayer(nn.Module):
         encoder_attention_mask=None,
         past_key_value=None,
         output_attentions=False,
+        mixed_layers=None,
     ):
         # decoder uni-directional self-attention cached key/values tuple is at positions 1,2
         self_attn_past_key_value = past_key_value[:2] if past_key_value is not None else None
@@ -465,6 +545,7 @@ class BertLayer(nn.Module):
             head_mask,
             output_attentions=output_attentions,
             past_key_value=self_attn_past_key_value,
+            mixed_layers=mixed_layers,
         )
         attention_output = self_attention_outputs[0]
 
@@ -567,6 +648,9 @@ class BertCLSMulti(nn.Module):
     def forward(self, hidden_states, event=0):
         hidden_states = hidden_states.flatten(start_dim=1)
         hidden_states = self.net(hidden_states)
+        if event is None:
+            # logits of all events from the shared representation, [batch, num_event, out_feature]
+            return torch.stack([net_out(hidden_states) for net_out in self.net_out], dim=1)
         output = self.net_out[event](hidden_states)
         return output
 
@@ -584,6 +668,7 @@ class BertEncoder(nn.Module):
         head_mask=None,
         output_attentions=False,
         output_hidden_states=True,
+        first_layer_mixed_layers=None,
         ):
         # decide whether or not return attention and hidden states of all layers
         all_hidden_states = () if output_hidden_states else None
@@ -601,6 +686,7 @@ class BertEncoder(nn.Module):
                 attention_mask,
                 layer_head_mask,
                 output_attentions,
+                mixed_layers=first_layer_mixed_layers if i == 0 else None,
             )
 
             hidden_states = layer_outputs[0]
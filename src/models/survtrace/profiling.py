@@ -0,0 +1,74 @@
+'''torch.profiler hooks for survtrace training and inference.
+Traces are exported for chrome://tracing (or perfetto) together with a table of the top operators.
+'''
+import os
+import torch
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+DEFAULT_PROFILE_DIR = os.path.join(ROOT_DIR, 'results', 'profiles')
+
+# steps skipped, warmed up and recorded when profiling the training loop
+DEFAULT_SCHEDULE = {'wait': 1, 'warmup': 1, 'active': 3, 'repeat': 1}
+
+
+class _NullProfiler:
+    '''stands in for the profiler when profiling is off.'''
+    def step(self):
+        pass
+
+    def stop(self):
+        pass
+
+NULL_PROFILER = _NullProfiler()
+
+
+def _export_handler(name, output_dir, row_limit):
+    '''on_trace_ready callback writing `{name}-{pid}-step{n}.json` (chrome trace) and `.txt` (top operators).
+    '''
+    sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+    def handler(prof):
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f'{name}-{os.getpid()}-step{prof.step_num}')
+        prof.export_chrome_trace(path + '.json')
+        with open(path + '.txt', 'w') as f:
+            f.write(prof.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=row_limit))
+    return handler
+
+
+def make_profiler(name, schedule=None, output_dir=None, row_limit=30):
+    '''torch.profiler recording input shapes and memory.
+
+    Arguments:
+        name {str} -- prefix of the exported files.
+        schedule {dict} -- wait/warmup/active/repeat steps of the window to record, see
+            `torch.profiler.schedule`, None records everything between start and stop.
+        output_dir {str} -- where traces and tables are written (default: {DEFAULT_PROFILE_DIR})
+        row_limit {int} -- number of operators in the table.
+
+    Returns:
+        torch.profiler.profile -- not started.
+    '''
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(**schedule) if schedule is not None else None,
+        on_trace_ready=_export_handler(name, output_dir or DEFAULT_PROFILE_DIR, row_limit),
+        record_shapes=True,
+        profile_memory=True,
+    )
+
+
+def start_profiler(name, profile, output_dir=None, default_schedule=None):
+    '''started profiler for a `profile` switch, `NULL_PROFILER` when it is off.
+
+    Arguments:
+        profile {bool, dict} -- False/None is off, True uses `default_schedule`, a dict is the schedule.
+    '''
+    if not profile:
+        return NULL_PROFILER
+    schedule = default_schedule if profile is True else profile
+    profiler = make_profiler(name, schedule, output_dir)
+    profiler.start()
+    return profiler
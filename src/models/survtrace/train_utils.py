@@ -2,20 +2,58 @@
 '''
 from collections import defaultdict
 import pdb
+import io
 import os
 import math
+import inspect
+import queue
+import socket
+import threading
+import time
+import multiprocessing
 from matplotlib.pyplot import axes
 import numpy as np
 import torch
+from torch import nn
 from torch.optim import Optimizer
 from torch.nn.utils import clip_grad_norm_
 from torch import optim
+import torch.distributed as dist
+from scipy.stats import norm
 
 from .losses import NLLPCHazardLoss
+from .utils import to_model_inputs, pack_labels, autocast, null_context
+from .profiling import start_profiler, DEFAULT_PROFILE_DIR, DEFAULT_SCHEDULE, NULL_PROFILER
+
+def numpy_rng_state():
+    """numpy global RNG state as a tensor and plain python values, loadable with `torch.load(weights_only=True)`."""
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {'name': name, 'keys': torch.from_numpy(keys.astype(np.int64)), 'pos': int(pos),
+            'has_gauss': int(has_gauss), 'cached_gaussian': float(cached_gaussian)}
+
+def set_numpy_rng_state(state):
+    """restores a state from `numpy_rng_state`."""
+    np.random.set_state((state['name'], state['keys'].numpy().astype(np.uint32), state['pos'],
+                         state['has_gauss'], state['cached_gaussian']))
+
+def run_checkpoint_path(path, config, tag):
+    """`path` named after the run in `config`, e.g. './checkpoints/survtrace-survtrace-seer-event0-run2-resume.pt'."""
+    root, ext = os.path.splitext(path)
+    parts = [root]
+    for key, fmt in [('model', '{}'), ('data', '{}'), ('event_to_keep', 'event{}'), ('run_num', 'run{}')]:
+        if config.get(key) is not None:
+            parts.append(fmt.format(config[key]))
+    return '-'.join(parts + [tag]) + ext
+
+def save_atomic(state, path):
+    """`torch.save` to a temporary file renamed over `path`, so an interrupted write never leaves a corrupt checkpoint."""
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
 
 class EarlyStopping:
     """Early stops the training if validation loss doesn't improve after a given patience."""
-    def __init__(self, patience=7, verbose=False, delta=0):
+    def __init__(self, patience=7, verbose=False, delta=0, in_memory=False, async_save=False):
         """
         Args:
             patience (int): How long to wait after last time validation loss improved.
@@ -24,6 +62,10 @@ class EarlyStopping:
                             Default: False
             delta (float): Minimum change in the monitored quantity to qualify as an improvement.
                             Default: 0
+            in_memory (bool): If True, keeps a copy of the best state in memory instead of saving it with `torch.save`.
+                            Default: False
+            async_save (bool): If True with in_memory, also writes the best state to disk in a background thread.
+                            Default: False
         """
         self.patience = patience
         self.verbose = verbose
@@ -32,6 +74,10 @@ class EarlyStopping:
         self.early_stop = False
         self.val_loss_min = np.Inf
         self.delta = delta
+        self.in_memory = in_memory
+        self.async_save = async_save
+        self.best_state = None
+        self._save_thread = None
 
     def __call__(self, val_loss, model, name='checkpoint.pt'):
 
@@ -54,9 +100,90 @@ class EarlyStopping:
         '''Saves model when validation loss decrease.'''
         if self.verbose:
             print(f'Validation loss decreased ({self.val_loss_min:.6f} --> {val_loss:.6f}).  Saving model ...')
-        torch.save(model.state_dict(), name)
+        if self.in_memory:
+            self.best_state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+            if self.async_save:
+                # at most one write in flight, the snapshot is not modified afterwards
+                self.wait()
+                self._save_thread = threading.Thread(target=save_atomic, args=(self.best_state, name))
+                self._save_thread.start()
+        else:
+            save_atomic(model.state_dict(), name)
         self.val_loss_min = val_loss
 
+    def state_dict(self):
+        '''Counters and best state, to resume training.'''
+        return {
+            'counter': self.counter,
+            'best_score': self.best_score,
+            'early_stop': self.early_stop,
+            'val_loss_min': self.val_loss_min,
+            'best_state': self.best_state,
+        }
+
+    def load_state_dict(self, state_dict):
+        self.counter = state_dict['counter']
+        self.best_score = state_dict['best_score']
+        self.early_stop = state_dict['early_stop']
+        self.val_loss_min = state_dict['val_loss_min']
+        self.best_state = state_dict['best_state']
+
+    def wait(self):
+        '''Waits for the background write of the best state to finish.'''
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+    def load_best(self, model, name):
+        '''Loads the best state into model, from memory or from the checkpoint written by save_checkpoint.'''
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+        else:
+            model.load_state_dict(torch.load(name))
+
+class EpochShuffler:
+    """Random permutations of the training indices on the training device, one per epoch.
+    The permutation of the next epoch is drawn in a background thread while the current epoch trains.
+    It uses its own generator, seeded from numpy, so the main thread's torch RNG is left untouched."""
+    def __init__(self, num_sample, device=None, seed=None):
+        """
+        Args:
+            num_sample (int): Number of training samples.
+            device (torch.device): Device the permutations are moved to.
+            seed (int): Seed of the generator. Default: drawn from `np.random`.
+        """
+        self.num_sample = num_sample
+        self.device = device
+        self.generator = torch.Generator()
+        self.generator.manual_seed(int(np.random.randint(2**31 - 1)) if seed is None else seed)
+        self._prefetch()
+
+    def _prefetch(self):
+        # generator state that draws the prefetched permutation, see `state_dict`
+        self._next_state = self.generator.get_state()
+        self._thread = threading.Thread(target=self._draw, daemon=True)
+        self._thread.start()
+
+    def _draw(self):
+        perm = torch.randperm(self.num_sample, generator=self.generator)
+        self._next_perm = perm.to(self.device) if self.device is not None else perm
+
+    def next(self):
+        """Returns the permutation of this epoch and starts drawing the next one."""
+        self._thread.join()
+        perm = self._next_perm
+        self._prefetch()
+        return perm
+
+    def state_dict(self):
+        """Generator state that draws the permutation returned by the next call of `next`."""
+        return {'generator': self._next_state}
+
+    def load_state_dict(self, state_dict):
+        self._thread.join()
+        self.generator.set_state(state_dict['generator'])
+        self._prefetch()
+
 def pad_col(input, val=0, where='end'):
     """Addes a column of `val` at the start of end of `input`."""
     if len(input.shape) != 2:
@@ -109,10 +236,14 @@ class BERTAdam(Optimizer):
         e: Adams epsilon. Default: 1e-6
         weight_decay_rate: Weight decay. Default: 0.01
         max_grad_norm: Maximum norm for the gradients (-1 means no clipping). Default: 1.0
+        clip_mode: 'per_tensor' clips the gradient of each parameter to max_grad_norm (original behaviour),
+            'global' clips the norm over all gradients, to the max_grad_norm of each group. Default: 'per_tensor'
+        foreach: update all parameters of a group with multi-tensor (`torch._foreach_*`) kernels,
+            the parameter by parameter loop is kept otherwise. Default: None, used where available
     """
     def __init__(self, params, lr, warmup=-1, t_total=-1, schedule='warmup_linear',
                  b1=0.9, b2=0.999, e=1e-6, weight_decay_rate=0.01,
-                 max_grad_norm=1.0):
+                 max_grad_norm=1.0, clip_mode='per_tensor', foreach=None):
         if not lr >= 0.0:
             raise ValueError("Invalid learning rate: {} - should be >= 0.0".format(lr))
         if schedule not in SCHEDULES:
@@ -125,6 +256,11 @@ class BERTAdam(Optimizer):
             raise ValueError("Invalid b2 parameter: {} - should be in [0.0, 1.0[".format(b2))
         if not e >= 0.0:
             raise ValueError("Invalid epsilon value: {} - should be >= 0.0".format(e))
+        if clip_mode not in ['per_tensor', 'global']:
+            raise ValueError("Invalid clip_mode: {} - should be 'per_tensor' or 'global'".format(clip_mode))
+        self.clip_mode = clip_mode
+        # falls back to the loop on torch versions without multi-tensor kernels
+        self.foreach = foreach is not False and hasattr(torch, '_foreach_addcmul_')
         defaults = dict(lr=lr, schedule=schedule, warmup=warmup, t_total=t_total,
                         b1=b1, b2=b2, e=e, weight_decay_rate=weight_decay_rate,
                         max_grad_norm=max_grad_norm)
@@ -179,12 +315,15 @@ class BERTAdam(Optimizer):
         if closure is not None:
             loss = closure()
 
+        if self.clip_mode == 'global':
+            self._clip_global()
+
         for group in self.param_groups:
+            params = []
             for p in group['params']:
                 if p.grad is None:
                     continue
-                grad = p.grad.data
-                if grad.is_sparse:
+                if p.grad.is_sparse:
                     raise RuntimeError('Adam does not support sparse gradients, please consider SparseAdam instead')
 
                 state = self.state[p]
@@ -196,55 +335,305 @@ class BERTAdam(Optimizer):
                     state['next_m'] = torch.zeros_like(p.data)
                     # Exponential moving average of squared gradient values
                     state['next_v'] = torch.zeros_like(p.data)
+                params.append(p)
 
-                next_m, next_v = state['next_m'], state['next_v']
-                beta1, beta2 = group['b1'], group['b2']
-
-                # Add grad clipping
-                if group['max_grad_norm'] > 0:
-                    clip_grad_norm_(p, group['max_grad_norm'])
-
-                # Decay the first and second moment running average coefficient
-                # In-place operations to update the averages at the same time
-                next_m.mul_(beta1).add_(1 - beta1, grad)
-                next_v.mul_(beta2).addcmul_(1 - beta2, grad, grad)
-                update = next_m / (next_v.sqrt() + group['e'])
-
-                # Just adding the square of the weights to the loss function is *not*
-                # the correct way of using L2 regularization/weight decay with Adam,
-                # since that will interact with the m and v parameters in strange ways.
-                #
-                # Instead we want ot decay the weights in a manner that doesn't interact
-                # with the m/v parameters. This is equivalent to adding the square
-                # of the weights to the loss with plain (non-momentum) SGD.
-                if group['weight_decay_rate'] > 0.0:
-                    update += group['weight_decay_rate'] * p.data
+            if not params:
+                continue
+            if self.foreach:
+                self._foreach_step(group, params)
+            else:
+                self._single_tensor_step(group, params)
+
+        return loss
+
+    def _clip_global(self):
+        """one norm over the gradients of every group, each group is clipped to its own max_grad_norm."""
+        grads = [p.grad for group in self.param_groups for p in group['params'] if p.grad is not None]
+        if not grads or all(group['max_grad_norm'] <= 0 for group in self.param_groups):
+            return
+        total_norm = torch.norm(torch.stack([torch.norm(grad.detach(), 2) for grad in grads]), 2)
+        for group in self.param_groups:
+            if group['max_grad_norm'] <= 0:
+                continue
+            # scale of 1 when the norm is within bounds, so there is no host sync on the comparison
+            clip_coef = (group['max_grad_norm'] / (total_norm + 1e-6)).clamp(max=1.0)
+            for p in group['params']:
+                if p.grad is not None:
+                    p.grad.detach().mul_(clip_coef)
+
+    def _lr_scheduled(self, group, state):
+        if group['t_total'] != -1:
+            schedule_fct = SCHEDULES[group['schedule']]
+            return group['lr'] * schedule_fct(state['step']/group['t_total'], group['warmup'])
+        return group['lr']
+
+    def _single_tensor_step(self, group, params):
+        """original update, one parameter at a time."""
+        for p in params:
+            grad = p.grad.data
+            state = self.state[p]
+            next_m, next_v = state['next_m'], state['next_v']
+            beta1, beta2 = group['b1'], group['b2']
+
+            # Add grad clipping
+            if self.clip_mode == 'per_tensor' and group['max_grad_norm'] > 0:
+                clip_grad_norm_(p, group['max_grad_norm'])
+
+            # Decay the first and second moment running average coefficient
+            # In-place operations to update the averages at the same time
+            next_m.mul_(beta1).add_(grad, alpha=1 - beta1)
+            next_v.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+            update = next_m / (next_v.sqrt() + group['e'])
+
+            # Just adding the square of the weights to the loss function is *not*
+            # the correct way of using L2 regularization/weight decay with Adam,
+            # since that will interact with the m and v parameters in strange ways.
+            #
+            # Instead we want ot decay the weights in a manner that doesn't interact
+            # with the m/v parameters. This is equivalent to adding the square
+            # of the weights to the loss with plain (non-momentum) SGD.
+            if group['weight_decay_rate'] > 0.0:
+                update += group['weight_decay_rate'] * p.data
+
+            lr_scheduled = self._lr_scheduled(group, state)
+
+            update_with_lr = lr_scheduled * update
+            p.data.add_(-update_with_lr)
+
+            state['step'] += 1
+
+            # step_size = lr_scheduled * math.sqrt(bias_correction2) / bias_correction1
+            # bias_correction1 = 1 - beta1 ** state['step']
+            # bias_correction2 = 1 - beta2 ** state['step']
+
+    def _foreach_step(self, group, params):
+        """same update as `_single_tensor_step` with multi-tensor kernels over all parameters of the group."""
+        states = [self.state[p] for p in params]
+        grads = [p.grad.data for p in params]
+        datas = [p.data for p in params]
+        next_ms = [state['next_m'] for state in states]
+        next_vs = [state['next_v'] for state in states]
+        beta1, beta2 = group['b1'], group['b2']
+
+        # per tensor clipping, as clip_grad_norm_ on each parameter
+        if self.clip_mode == 'per_tensor' and group['max_grad_norm'] > 0:
+            norms = torch._foreach_norm(grads) if hasattr(torch, '_foreach_norm') else [grad.norm() for grad in grads]
+            clip_coefs = (group['max_grad_norm'] / (torch.stack(norms) + 1e-6)).clamp(max=1.0)
+            torch._foreach_mul_(grads, clip_coefs.tolist())
+
+        torch._foreach_mul_(next_ms, beta1)
+        torch._foreach_add_(next_ms, grads, alpha=1 - beta1)
+        torch._foreach_mul_(next_vs, beta2)
+        torch._foreach_addcmul_(next_vs, grads, grads, value=1 - beta2)
+        denoms = torch._foreach_sqrt(next_vs)
+        torch._foreach_add_(denoms, group['e'])
+        updates = torch._foreach_div(next_ms, denoms)
+
+        # decoupled weight decay, see `_single_tensor_step`
+        if group['weight_decay_rate'] > 0.0:
+            torch._foreach_add_(updates, datas, alpha=group['weight_decay_rate'])
+
+        torch._foreach_mul_(updates, [self._lr_scheduled(group, state) for state in states])
+        torch._foreach_sub_(datas, updates)
+
+        for state in states:
+            state['step'] += 1
 
-                if group['t_total'] != -1:
-                    schedule_fct = SCHEDULES[group['schedule']]
-                    lr_scheduled = group['lr'] * schedule_fct(state['step']/group['t_total'], group['warmup'])
-                else:
-                    lr_scheduled = group['lr']
 
-                update_with_lr = lr_scheduled * update
-                p.data.add_(-update_with_lr)
+############################
+# training step #
+############################
 
-                state['step'] += 1
+def uses_interval_frac(loss):
+    """True if `loss` takes the interval fraction (IPS, e.g. `NLLPCHazardLoss`),
+    False if it only takes durations and events (w/o IPS, e.g. `NLLLogistiHazardLoss`)."""
+    forward = loss.forward if isinstance(loss, nn.Module) else loss
+    required = [param for param in inspect.signature(forward).parameters.values()
+        if param.default is inspect.Parameter.empty and param.kind == inspect.Parameter.POSITIONAL_OR_KEYWORD]
+    return len(required) >= 4
+
+class TrainingStep(nn.Module):
+    """Loss of one batch with the survival loss, the MTL terms and the target columns bound once.
+    The loss signature is resolved when the step is built, so no exception is raised and
+    caught per batch, and the forward has no python fallbacks, so it can go through `torch.compile`.
+
+    Labels are packed as in `utils.pack_labels`:
+        y[..., 0] - quantile/time
+        y[..., 1] - event indicator
+        y[..., 2] - proportion
+    """
+    def __init__(self, model, metrics, gamma1=1, gamma2=1):
+        """
+        Args:
+            model (nn.Module): SurvTraceSingle or SurvTraceMulti.
+            metrics (list): survival loss, then the event (BCE) and time (MSE) losses if the model has MTL heads.
+            gamma1 (float): Weight of the event loss.
+            gamma2 (float): Weight of the time loss.
+        """
+        super().__init__()
+        self.model = model
+        self.survival_loss = metrics[0]
+        self.use_interval_frac = uses_interval_frac(metrics[0])
+        # the loss takes the logits of all risks [batch, num_event, T] in one call
+        self.stacked_events = getattr(metrics[0], 'supports_stacked_events', False)
+        self.has_mtl = model.has_mtl
+        if self.has_mtl:
+            self.event_loss, self.time_loss = metrics[1], metrics[2]
+        self.gamma1 = gamma1
+        self.gamma2 = gamma2
+        self.multi_event = model.config.num_event > 1
+
+    def survival_nll(self, phi, y, reduction='mean'):
+        """survival loss of the logits `phi` [batch, T] given labels `y` [batch, 3],
+        or of stacked logits [batch, num_event, T] given labels [batch, num_event, 3]."""
+        if self.use_interval_frac:
+            # IPS
+            return self.survival_loss(phi, y[...,0].long(), y[...,1].long(), y[...,2], reduction=reduction)
+        # w/o IPS
+        return self.survival_loss(phi, y[...,0].long(), y[...,1].long(), reduction=reduction)
+
+    def validation_loss(self, phi, y, reduction='mean'):
+        """survival loss of `predict` outputs, summed over the risks for competing events."""
+        if not self.multi_event or self.stacked_events:
+            return self.survival_nll(phi, y, reduction)
+        loss = 0
+        for risk in range(y.shape[1]):
+            loss = loss + self.survival_nll(phi[:, risk], y[:, risk], reduction)
+        return loss
 
-                # step_size = lr_scheduled * math.sqrt(bias_correction2) / bias_correction1
-                # bias_correction1 = 1 - beta1 ** state['step']
-                # bias_correction2 = 1 - beta2 ** state['step']
+    def model_forward(self, x_cat, x_num):
+        if self.multi_event:
+            # encode the batch once, phi[1] holds the logits of all risks: [batch, num_event, out_feature]
+            return self.model(input_ids=x_cat, input_nums=x_num, event=None)
+        return self.model(input_ids=x_cat, input_nums=x_num)
+
+    def loss(self, phi, y):
+        """training loss of the model outputs `phi` given labels `y`."""
+        if self.multi_event:
+            loss = self.validation_loss(phi[1], y)
+            # see if any event has happened, time is the same for each risk
+            y_event, y_time = y[:, :, 1].sum(1), y[:, 0, 0]
+        else:
+            loss = self.survival_nll(phi[1], y)
+            y_event, y_time = y[:, 1], y[:, 0]
 
+        # add in mtl, heads may output bfloat16 under autocast
+        if self.has_mtl:
+            loss = loss + self.gamma1*self.event_loss(phi[2].squeeze(-1).float(), y_event)   # event
+            loss = loss + self.gamma2*self.time_loss(phi[3].squeeze(-1).float(), y_time)     # time
         return loss
 
+    def forward(self, x_cat, x_num, y):
+        return self.loss(self.model_forward(x_cat, x_num), y)
+
+############################
+# timers #
+############################
+
+# with compile_step the forward and the loss are fused, both are then counted in 'forward'
+PHASES = ['data', 'forward', 'loss', 'backward', 'optimizer', 'validation', 'checkpoint']
+
+class _Phase:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.timer.synchronize()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.synchronize()
+        self.timer.times[self.name] += time.perf_counter() - self.start
+
+class PhaseTimer:
+    """Wall-clock seconds spent in each training phase (see `PHASES`) during the current epoch.
+    When disabled `phase` returns a shared no-op context, so the timers cost one call per phase."""
+    def __init__(self, enabled=False, use_gpu=False):
+        """
+        Args:
+            enabled (bool): Whether to time the phases.
+            use_gpu (bool): Synchronize cuda around each phase, so asynchronous kernels are counted in their phase.
+        """
+        self.enabled = enabled
+        self.use_gpu = use_gpu
+        self.times = dict.fromkeys(PHASES, 0.)
+        self._null_phase = null_context()
+
+    def phase(self, name):
+        if not self.enabled:
+            return self._null_phase
+        return _Phase(self, name)
+
+    def synchronize(self):
+        if self.use_gpu:
+            torch.cuda.synchronize()
+
+    def end_epoch(self, train_logs):
+        """Appends the times of the epoch to `train_logs['time_{phase}']` and resets them."""
+        if not self.enabled:
+            return
+        for name in PHASES:
+            train_logs['time_{}'.format(name)].append(self.times[name])
+        self.times = dict.fromkeys(PHASES, 0.)
+
+############################
+# data parallel #
+############################
+
+def all_reduce_gradients(model, world_size):
+    """Averages the gradients of `model` over the data-parallel workers with a single all-reduce."""
+    grads = [p.grad for p in model.parameters() if p.grad is not None]
+    flat_grads = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat_grads)
+    flat_grads.div_(world_size)
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat_grads[offset:offset+grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+def _free_port():
+    """A free local TCP port for the process group rendezvous."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _distributed_worker(rank, world_size, port, seed, model, metrics, gamma1, gamma2, compile_step, fit_kwargs, results):
+    """Entry point of a data-parallel worker, the main worker (rank 0) puts the trained weights and logs on `results`."""
+    dist.init_process_group('gloo', init_method=f'tcp://127.0.0.1:{port}', rank=rank, world_size=world_size)
+    try:
+        # split the cores between the workers
+        torch.set_num_threads(max(1, torch.get_num_threads() // world_size))
+        # dropout differs between workers, the permutation of the training set is shared
+        torch.manual_seed(seed + rank)
+        np.random.seed((seed + rank) % 2**32)
+
+        trainer = Trainer(model, metrics, gamma1, gamma2, compile_step=compile_step, world_size=world_size)
+        trainer.rank = rank
+        trainer.shuffle_seed = seed
+        # start from the weights of the main worker
+        for param in trainer.model.parameters():
+            dist.broadcast(param.data, src=0)
+
+        logs = trainer.fit(**fit_kwargs)
+        if rank == 0:
+            # tensors on a queue are shared through file descriptors that the parent fetches from this
+            # process, which may have exited by then, so the weights are sent as serialized bytes
+            buffer = io.BytesIO()
+            torch.save(trainer.model.state_dict(), buffer)
+            results.put((buffer.getvalue(), logs, dict(trainer.train_logs)))
+    finally:
+        dist.destroy_process_group()
 
 ############################
 # trainer #
 ############################
 
 class Trainer:
-    def __init__(self, model, metrics=None, gamma1=1, gamma2=1):
+    def __init__(self, model, metrics=None, gamma1=1, gamma2=1, compile_step=False, world_size=1):
         '''metrics must start from NLLPCHazardLoss, then be others
+        compile_step runs the training step through `torch.compile` when available (torch>=2.0).
+        world_size > 1 trains with that many data-parallel cpu processes over torch.distributed (gloo).
         '''
         self.model = model
         if metrics is None:
@@ -258,19 +647,229 @@ class Trainer:
 
         self.train_logs = defaultdict(list)
         self.get_target = lambda df: (df['duration'].values, df['event'].values)
-        self.use_gpu = True if torch.cuda.is_available() else False
+        self.compile_step = compile_step
+
+        # data-parallel workers, rank and shuffle_seed are set in each worker by `_distributed_worker`
+        self.world_size = world_size
+        self.rank = 0
+        self.shuffle_seed = None
+
+        # data-parallel training runs on cpu
+        self.use_gpu = True if torch.cuda.is_available() and world_size == 1 else False
         if self.use_gpu:
             print('use pytorch-cuda for training.')
             self.model.cuda()
             self.model.use_gpu = True
         else:
             print('GPU not found! will use cpu for training!')
+        # mixed precision policy of the training step, 'fp32' or 'bf16', predict follows model.precision
+        self.precision = model.config.get('precision', 'fp32')
+        self.device_type = 'cuda' if self.use_gpu else 'cpu'
+        self.training_step = TrainingStep(self.model, self.metrics, gamma1, gamma2)
+        self.step_fn = self.training_step
+        if compile_step:
+            if hasattr(torch, 'compile'):
+                self.step_fn = torch.compile(self.training_step)
+            else:
+                print('torch.compile not available! will run the training step eagerly!')
         self.early_stopping = None
         ckpt_dir = os.path.dirname(model.config['checkpoint'])
         self.ckpt = model.config['checkpoint']
+        # best state kept in memory, optionally written in the background to a path named after this run
+        self.keep_best_in_memory = model.config.get('keep_best_in_memory', False)
+        self.async_checkpoint = model.config.get('async_checkpoint', False)
+        if self.keep_best_in_memory and self.async_checkpoint:
+            self.ckpt = run_checkpoint_path(self.ckpt, model.config, 'best')
+        # validation every `val_every` epochs, or every `val_every_steps` optimizer steps when > 0,
+        # optionally on a fixed random subsample (a fraction or a number of samples) with a confidence band
+        self.val_every = model.config.get('val_every', 1)
+        self.val_every_steps = model.config.get('val_every_steps', 0)
+        self.val_subsample = model.config.get('val_subsample', None)
+        self.val_z = None
+        if self.val_subsample is not None:
+            self.val_z = norm.ppf(0.5 + model.config.get('val_confidence', 0.95) / 2)
+        # per epoch seconds of each phase in train_logs['time_{phase}'], off by default
+        self.timer = PhaseTimer(model.config.get('phase_timers', False), self.use_gpu)
+        # torch.profiler over a window of training steps, True uses profiling.DEFAULT_SCHEDULE
+        self.profile = model.config.get('profile', None)
+        self.profile_dir = model.config.get('profile_dir', None) or DEFAULT_PROFILE_DIR
+        self.profiler = NULL_PROFILER
+        # full training state written every `resume_every` epochs for `fit(resume_from=...)`, 0 disables it
+        self.resume_every = model.config.get('resume_every', 0)
+        self.resume_ckpt = model.config.get('resume_checkpoint') or \
+            run_checkpoint_path(model.config['checkpoint'], model.config, 'resume')
         if not os.path.exists(ckpt_dir):
             os.makedirs(ckpt_dir)
 
+    def make_early_stopping(self):
+        return EarlyStopping(patience=self.model.config['early_stop_patience'],
+            in_memory=self.keep_best_in_memory, async_save=self.async_checkpoint)
+
+    def save_training_state(self, epoch, optimizer, shuffler, train_loss_list, val_loss_list):
+        """Writes everything needed to continue training after `epoch` to `self.resume_ckpt`:
+        weights, BERTAdam moments and steps, early stopping counters, the shuffler and the numpy/torch RNG.
+        Runs every `resume_every` epochs on the main worker."""
+        if self.resume_every <= 0 or (epoch + 1) % self.resume_every != 0 or self.rank != 0:
+            return
+        state = {
+            'epoch': epoch,
+            'model': self.model.state_dict(),
+            'optimizer': optimizer.state_dict(),
+            'early_stopping': self.early_stopping.state_dict() if self.early_stopping is not None else None,
+            'shuffler': shuffler.state_dict(),
+            'train_loss_list': train_loss_list,
+            'val_loss_list': val_loss_list,
+            'numpy_rng': numpy_rng_state(),
+            'torch_rng': torch.get_rng_state(),
+            'cuda_rng': torch.cuda.get_rng_state_all() if self.use_gpu else None,
+        }
+        # write then rename, so an eviction during the write keeps the previous state
+        save_atomic(state, self.resume_ckpt)
+
+    def load_training_state(self, path, optimizer, shuffler):
+        """Restores a state written by `save_training_state`.
+
+        Returns:
+            tuple -- (epoch to start from, train_loss_list, val_loss_list)
+        """
+        # RNG states must stay on cpu, load_state_dict moves weights and moments to the model device
+        # the state only holds tensors and plain python values (see `numpy_rng_state`), so it loads without unpickling code
+        load_kwargs = {'weights_only': True} if 'weights_only' in inspect.signature(torch.load).parameters else {}
+        state = torch.load(path, map_location='cpu', **load_kwargs)
+        self.model.load_state_dict(state['model'])
+        optimizer.load_state_dict(state['optimizer'])
+        if self.early_stopping is not None and state['early_stopping'] is not None:
+            self.early_stopping.load_state_dict(state['early_stopping'])
+        shuffler.load_state_dict(state['shuffler'])
+        set_numpy_rng_state(state['numpy_rng'])
+        torch.set_rng_state(state['torch_rng'])
+        if self.use_gpu and state['cuda_rng'] is not None:
+            torch.cuda.set_rng_state_all(state['cuda_rng'])
+        print(f"resumes training at epoch {state['epoch']+2} from {path}")
+        return state['epoch'] + 1, state['train_loss_list'], state['val_loss_list']
+
+    def compute_loss(self, x_cat, x_num, y):
+        """Loss of a batch, the forward and the loss are timed separately when the phase timers are on.
+        A compiled step fuses both, it is timed as a whole in the 'forward' phase."""
+        if not self.timer.enabled:
+            return self.step_fn(x_cat, x_num, y)
+        if self.step_fn is not self.training_step:
+            with self.timer.phase('forward'):
+                return self.step_fn(x_cat, x_num, y)
+        with self.timer.phase('forward'):
+            phi = self.training_step.model_forward(x_cat, x_num)
+        with self.timer.phase('loss'):
+            return self.training_step.loss(phi, y)
+
+    def subsample_validation(self, tensor_val, tensor_y_val):
+        """Fixed random subsample of the validation set of `val_subsample` samples (or fraction),
+        drawn with the config seed so every check scores the same samples."""
+        if self.val_subsample is None:
+            return tensor_val, tensor_y_val
+        num_val = len(tensor_y_val)
+        size = int(self.val_subsample * num_val) if self.val_subsample < 1 else int(self.val_subsample)
+        size = min(max(size, 2), num_val)
+        index = np.random.RandomState(self.model.config.get('seed', 1234)).choice(num_val, size, replace=False)
+        index = torch.from_numpy(np.sort(index)).to(tensor_y_val.device)
+        return tuple(t[index] for t in tensor_val), tensor_y_val[index]
+
+    def validate(self, tensor_val, tensor_y_val, val_batch_size):
+        """Validation loss, and the half width of its confidence band when validating on a subsample."""
+        self.model.eval()
+        with torch.no_grad():
+            if self.training_step.multi_event:
+                # one pass over the validation set for all risks
+                phi_val = self.model.predict(tensor_val, val_batch_size, event=None)
+            else:
+                phi_val = self.model.predict(tensor_val, val_batch_size)
+            if self.val_subsample is None:
+                return self.training_step.validation_loss(phi_val, tensor_y_val).item(), None
+            losses = self.training_step.validation_loss(phi_val, tensor_y_val, reduction='none')
+        return losses.mean().item(), self.val_z * losses.std().item() / math.sqrt(len(losses))
+
+    def validation_check(self, epoch, train_loss, val_data, val_batch_size, val_loss_list):
+        """Validates on the main worker and records the loss for early stopping.
+        Returns whether every worker should stop."""
+        early_stop = False
+        if self.rank == 0:
+            with self.timer.phase('validation'):
+                val_loss, val_band = self.validate(*val_data, val_batch_size)
+            print("[Train-{}]: {}".format(epoch, train_loss))
+            if val_band is None:
+                print("[Val-{}]: {}".format(epoch, val_loss))
+            else:
+                print("[Val-{}]: {} +/- {:.4f}".format(epoch, val_loss, val_band))
+            val_loss_list.append(val_loss)
+            with self.timer.phase('checkpoint'):
+                self.early_stopping(val_loss, self.model, name=self.ckpt)
+            early_stop = self.early_stopping.early_stop
+        return self.broadcast_flag(early_stop)
+
+    def stop_early(self, epoch):
+        self.timer.end_epoch(self.train_logs)
+        self.profiler.stop()
+        if self.rank == 0:
+            print(f"early stops at epoch {epoch+1}")
+            # load best checkpoint
+            self.early_stopping.load_best(self.model, self.ckpt)
+        self.finish_checkpoints()
+
+    def finish_checkpoints(self):
+        """Waits for the background write of the best state, which is kept on disk for this run."""
+        if self.early_stopping is None or self.rank != 0:
+            return
+        self.early_stopping.wait()
+        if self.keep_best_in_memory and self.async_checkpoint and os.path.isfile(self.ckpt):
+            print(f"best checkpoint written to {self.ckpt}")
+
+    def shard(self, perm):
+        """This worker's share of the epoch permutation, every worker gets the same number of samples."""
+        if self.world_size == 1:
+            return perm
+        perm = perm[:len(perm) - len(perm) % self.world_size]
+        return perm[self.rank::self.world_size]
+
+    def broadcast_flag(self, flag):
+        """`flag` of the main worker, so every worker takes the same decision."""
+        if self.world_size == 1:
+            return flag
+        flag = torch.tensor([int(flag)])
+        dist.broadcast(flag, src=0)
+        return bool(flag.item())
+
+    def fit_distributed(self, **fit_kwargs):
+        """Runs `fit` in `world_size` data-parallel processes on this machine and loads
+        the weights trained by the main worker into `self.model`.
+        Each worker trains on a shard of every epoch and gradients are averaged
+        over the workers before each `BERTAdam.step`."""
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        port = _free_port()
+        seed = int(np.random.randint(2**31 - 1))
+        model = self.model.cpu()
+        processes = [ctx.Process(target=_distributed_worker,
+            args=(rank, self.world_size, port, seed, model, self.metrics, self.gamma1, self.gamma2,
+                  self.compile_step, fit_kwargs, results))
+            for rank in range(self.world_size)]
+        for process in processes:
+            process.start()
+
+        while True:
+            try:
+                state_bytes, logs, train_logs = results.get(timeout=1)
+                break
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    for process in processes:
+                        process.terminate()
+                    raise RuntimeError("A data-parallel training worker failed, see its traceback above.")
+        for process in processes:
+            process.join()
+
+        self.model.load_state_dict(torch.load(io.BytesIO(state_bytes), map_location='cpu'))
+        self.train_logs.update(train_logs)
+        return logs
+
     def train_single_event(self,
         train_set,
         val_set=None,
@@ -279,21 +878,29 @@ class Trainer:
         learning_rate=1e-3,
         weight_decay=0,
         val_batch_size=None,
+        resume_from=None,
         **kwargs,
         ):
 
-        df_train, df_y_train = train_set
-        durations_train, events_train = self.get_target(df_y_train)
+        # features may be a dataframe or prebuilt (x_cat, x_num) arrays, converted only once
+        # into int64 categorical, float32 numerical and packed float32 labels
+        x_train, df_y_train = train_set
+        x_cat_train, x_num_train = to_model_inputs(x_train, self.model.config.num_categorical_feature)
+        y_train = pack_labels(df_y_train)
 
         if val_set is not None:
-            df_val, df_y_val = val_set
-            durations_val, events_val = self.get_target(df_y_val)
-            tensor_val = torch.tensor(val_set[0].values)
-            tensor_y_val = torch.tensor(val_set[1].values)
+            x_val, df_y_val = val_set
+            tensor_val = to_model_inputs(x_val, self.model.config.num_categorical_feature)
+            tensor_y_val = pack_labels(df_y_val)
+
+            if self.use_gpu:
+                tensor_val = tuple(t.cuda() for t in tensor_val)
+                tensor_y_val = tensor_y_val.cuda()
+            tensor_val, tensor_y_val = self.subsample_validation(tensor_val, tensor_y_val)
 
         if self.use_gpu:
-            tensor_val = tensor_val.cuda()
-            tensor_y_val = tensor_y_val.cuda()
+            x_cat_train, x_num_train = x_cat_train.cuda(), x_num_train.cuda()
+            y_train = y_train.cuda()
 
         # assign no weight decay on these parameters
         no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
@@ -306,85 +913,78 @@ class Trainer:
         optimizer = BERTAdam(optimizer_grouped_parameters,
             learning_rate,
             weight_decay_rate=weight_decay,
+            clip_mode=self.model.config.get('grad_clip_mode', 'per_tensor'),
+            foreach=self.model.config.get('foreach_optimizer', None),
             )
 
         if val_set is not None:
             # take early stopping
-            self.early_stopping = EarlyStopping(patience=self.model.config['early_stop_patience'])
+            self.early_stopping = self.make_early_stopping()
 
-        num_train_batch = int(np.ceil(len(df_y_train) / batch_size))
+        # with data-parallel workers each one trains on its shard of the permutation,
+        # batch_size is split between the workers
+        local_batch_size = max(1, batch_size // self.world_size)
+        num_train_batch = int(np.ceil(len(y_train) // self.world_size / local_batch_size))
+        shuffler = EpochShuffler(len(y_train), device=y_train.device, seed=self.shuffle_seed)
         train_loss_list, val_loss_list = [], []
-        for epoch in range(epochs):
+        start_epoch = 0
+        if resume_from is not None:
+            start_epoch, train_loss_list, val_loss_list = self.load_training_state(resume_from, optimizer, shuffler)
+        # profiles the main worker only
+        self.profiler = start_profiler('train', self.profile if self.rank == 0 else None, self.profile_dir, DEFAULT_SCHEDULE)
+        for epoch in range(start_epoch, epochs):
             epoch_loss = 0
             self.model.train()
-            df_train = train_set[0].sample(frac=1)
-            df_y_train = train_set[1].loc[df_train.index]
-
-            tensor_train = torch.tensor(df_train.values)
-            tensor_y_train = torch.tensor(df_y_train.values)
-            if self.use_gpu:
-                tensor_y_train = tensor_y_train.cuda()
-                tensor_train = tensor_train.cuda()
+            perm = self.shard(shuffler.next())
 
             for batch_idx in range(num_train_batch):
-                optimizer.zero_grad()
-
-                batch_train = tensor_train[batch_idx*batch_size:(batch_idx+1)*batch_size]
-                batch_y_train = tensor_y_train[batch_idx*batch_size:(batch_idx+1)*batch_size]
-
-                batch_x_cat = batch_train[:, :self.model.config.num_categorical_feature].long()
-                batch_x_num = batch_train[:, self.model.config.num_categorical_feature:].float()
-
-                phi = self.model(input_ids=batch_x_cat, input_nums=batch_x_num)
-
-                # batch_y_train[:, 0] - quantile/time
-                # batch_y_train[:, 1] - event indicator
-                # batch_y_train[:, 2] - proportion
-
-                # try NLLPCHazardLoss else NLLLogistiHazardLoss
-                try:
-                    # IPS
-                    batch_loss = self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long(), batch_y_train[:,2].float(), reduction="mean")
-                except:
-                    # w/o IPS
-                    batch_loss = self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long())
-
-                # add in mtl
-                if self.model.has_mtl:
-                    batch_loss += self.gamma1*(self.metrics[1](phi[2].squeeze(-1), batch_y_train[:, 1].float())) # event
-                    batch_loss += self.gamma2*(self.metrics[2](phi[3].squeeze(-1), batch_y_train[:, 0].float())) # time
-
-                batch_loss.backward()
-                optimizer.step()
+                with self.timer.phase('optimizer'):
+                    optimizer.zero_grad()
+
+                with self.timer.phase('data'):
+                    batch_index = perm[batch_idx*local_batch_size:(batch_idx+1)*local_batch_size]
+                    batch_x_cat = x_cat_train[batch_index]
+                    batch_x_num = x_num_train[batch_index]
+                    batch_y_train = y_train[batch_index]
+
+                with autocast(self.precision, self.device_type):
+                    batch_loss = self.compute_loss(batch_x_cat, batch_x_num, batch_y_train)
+                with self.timer.phase('backward'):
+                    batch_loss.backward()
+                    if self.world_size > 1:
+                        all_reduce_gradients(self.model, self.world_size)
+                with self.timer.phase('optimizer'):
+                    optimizer.step()
+                self.profiler.step()
 
                 epoch_loss += batch_loss.item()
 
-            train_loss_list.append(epoch_loss / (batch_idx+1))
+                # validation every val_every_steps optimizer steps, patience counts validation checks
+                if val_set is not None and self.val_every_steps > 0 \
+                        and (epoch*num_train_batch + batch_idx + 1) % self.val_every_steps == 0:
+                    was_training = self.model.training
+                    if self.validation_check(epoch, epoch_loss, (tensor_val, tensor_y_val), val_batch_size, val_loss_list):
+                        self.stop_early(epoch)
+                        return train_loss_list, val_loss_list, epoch+1
+                    self.model.train(was_training)
 
-            if val_set is not None:
-                self.model.eval()
-                with torch.no_grad():
-                    phi_val = self.model.predict(tensor_val, val_batch_size)
-                try:
-                    # IPS
-                    val_loss = self.metrics[0](phi_val, tensor_y_val[:,0].long(), tensor_y_val[:,1].long(), tensor_y_val[:,2].float())
-                except:
-                    # w/o IPS
-                    val_loss = self.metrics[0](phi_val, tensor_y_val[:,0].long(), tensor_y_val[:,1].long())
+            train_loss_list.append(epoch_loss / (batch_idx+1))
 
-                print("[Train-{}]: {}".format(epoch, epoch_loss))
-                print("[Val-{}]: {}".format(epoch, val_loss.item()))
-                val_loss_list.append(val_loss.item())
-                self.early_stopping(val_loss.item(), self.model, name=self.ckpt)
-                if self.early_stopping.early_stop:
-                    print(f"early stops at epoch {epoch+1}")
-                    # load best checkpoint
-                    self.model.load_state_dict(torch.load(self.ckpt))
+            if val_set is not None and self.val_every_steps <= 0 and (epoch+1) % self.val_every == 0:
+                # validation and checkpointing run on the main worker, which decides when every worker stops
+                if self.validation_check(epoch, epoch_loss, (tensor_val, tensor_y_val), val_batch_size, val_loss_list):
+                    self.stop_early(epoch)
                     return train_loss_list, val_loss_list, epoch+1
-            else:
+            elif self.rank == 0:
                 print("[Train-{}]: {}".format(epoch, epoch_loss))
 
-        return train_loss_list, val_loss_list, epoch+1
+            with self.timer.phase('checkpoint'):
+                self.save_training_state(epoch, optimizer, shuffler, train_loss_list, val_loss_list)
+            self.timer.end_epoch(self.train_logs)
+
+        self.profiler.stop()
+        self.finish_checkpoints()
+        return train_loss_list, val_loss_list, epochs
 
     def train_multi_event(self,
         train_set,
@@ -394,21 +994,29 @@ class Trainer:
         learning_rate=1e-3,
         weight_decay=0,
         val_batch_size=None,
+        resume_from=None,
         **kwargs,
         ):
 
-        if val_set is not None:
-            tensor_val = torch.tensor(val_set[0].values)
-            tensor_y_val = dict()
+        # features may be a dataframe or prebuilt (x_cat, x_num) arrays, converted only once
+        # into int64 categorical, float32 numerical and packed float32 labels
+        # labels are [N, num_event, 3], y[:, risk] holds (duration, event_{risk}, proportion)
+        x_train, df_y_train = train_set
+        x_cat_train, x_num_train = to_model_inputs(x_train, self.model.config.num_categorical_feature)
+        y_train = pack_labels(df_y_train, self.model.config.num_event)
 
-            for risk in range(self.model.config.num_event):
-                tensor_y_val_key = "risk_{}".format(risk)
-                tensor_y_val[tensor_y_val_key] = torch.tensor(val_set[1][["duration","event_{}".format(risk),"proportion"]].values)
+        if self.use_gpu:
+            x_cat_train, x_num_train = x_cat_train.cuda(), x_num_train.cuda()
+            y_train = y_train.cuda()
+
+        if val_set is not None:
+            tensor_val = to_model_inputs(val_set[0], self.model.config.num_categorical_feature)
+            tensor_y_val = pack_labels(val_set[1], self.model.config.num_event)
 
             if self.use_gpu:
-                tensor_val = tensor_val.cuda()
-                for key in tensor_y_val.keys():
-                    tensor_y_val[key] = tensor_y_val[key].cuda()
+                tensor_val = tuple(t.cuda() for t in tensor_val)
+                tensor_y_val = tensor_y_val.cuda()
+            tensor_val, tensor_y_val = self.subsample_validation(tensor_val, tensor_y_val)
 
         # assign no weight decay on these parameters
         no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
@@ -421,99 +1029,78 @@ class Trainer:
         optimizer = BERTAdam(optimizer_grouped_parameters,
             learning_rate,
             weight_decay_rate=weight_decay,
+            clip_mode=self.model.config.get('grad_clip_mode', 'per_tensor'),
+            foreach=self.model.config.get('foreach_optimizer', None),
             )
 
         if val_set is not None:
             # take early stopping
-            self.early_stopping = EarlyStopping(patience=self.model.config['early_stop_patience'])
+            self.early_stopping = self.make_early_stopping()
 
         train_loss_list, val_loss_list = [], []
-        num_train_batch = int(np.ceil(len(train_set[0]) / batch_size))
-        for epoch in range(epochs):
-            df_train = train_set[0].sample(frac=1)
-            df_y_train = train_set[1].loc[df_train.index]
-
-            tensor_train = torch.tensor(df_train.values)
-            tensor_y_train = {}
-            for risk in range(self.model.config.num_event):
-                tensor_y_train["risk_{}".format(risk)] = torch.tensor(df_y_train[["duration","event_{}".format(risk),"proportion"]].values)
-
-            if self.use_gpu:
-                tensor_train = tensor_train.cuda()
-                for key in tensor_y_train.keys():
-                    tensor_y_train[key] = tensor_y_train[key].cuda()
+        # with data-parallel workers each one trains on its shard of the permutation,
+        # batch_size is split between the workers
+        local_batch_size = max(1, batch_size // self.world_size)
+        num_train_batch = int(np.ceil(len(y_train) // self.world_size / local_batch_size))
+        shuffler = EpochShuffler(len(y_train), device=y_train.device, seed=self.shuffle_seed)
+        start_epoch = 0
+        if resume_from is not None:
+            start_epoch, train_loss_list, val_loss_list = self.load_training_state(resume_from, optimizer, shuffler)
+        # profiles the main worker only
+        self.profiler = start_profiler('train', self.profile if self.rank == 0 else None, self.profile_dir, DEFAULT_SCHEDULE)
+        for epoch in range(start_epoch, epochs):
+            # validation leaves the model in eval mode
+            self.model.train()
+            perm = self.shard(shuffler.next())
 
             epoch_loss = 0
             for batch_idx in range(num_train_batch):
-                optimizer.zero_grad()
-
-                batch_train = tensor_train[batch_idx*batch_size:(batch_idx+1)*batch_size]
-
-                batch_x_cat = batch_train[:, :self.model.config.num_categorical_feature].long()
-                batch_x_num = batch_train[:, self.model.config.num_categorical_feature:].float()
-
-                batch_loss = None
-                # batch_y_train[:, 0] - quantile/time
-                # batch_y_train[:, 1] - event indicator
-                # batch_y_train[:, 2] - proportion
-                # Note: time and proportion are the same for each risk
-                for risk in range(self.model.config.num_event):
-                    phi = self.model(input_ids=batch_x_cat, input_nums=batch_x_num, event=risk)
-                    batch_y_train = tensor_y_train["risk_{}".format(risk)][batch_idx*batch_size:(batch_idx+1)*batch_size]
-
-                    if batch_loss is None:
-                        # try NLLPCHazardLoss else NLLLogistiHazardLoss
-                        try:
-                            # IPS
-                            batch_loss = self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long(), batch_y_train[:,2].float())
-                        except:
-                            batch_loss = self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long())
-                    else:
-                        # try NLLPCHazardLoss else NLLLogistiHazardLoss
-                        try:
-                            # IPS
-                            batch_loss += self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long(), batch_y_train[:,2].float())
-                        except:
-                            batch_loss += self.metrics[0](phi[1], batch_y_train[:,0].long(), batch_y_train[:,1].long())
-
-                # add MTL
-                if self.model.has_mtl:
-                    batch_y_event_train = tensor_y_train['risk_0'][batch_idx*batch_size:(batch_idx+1)*batch_size][:,1] + \
-                        tensor_y_train['risk_1'][batch_idx*batch_size:(batch_idx+1)*batch_size][:,1]     # see if any event has happened
-                    batch_loss += self.gamma1*(self.metrics[1](phi[2].squeeze(-1), batch_y_event_train.float()))       # event
-                    batch_loss += self.gamma2*(self.metrics[2](phi[3].squeeze(-1), batch_y_train[:, 0].float()))       # time - event/censoring time same for each risk
-
-
-                batch_loss.backward()
-                optimizer.step()
+                with self.timer.phase('optimizer'):
+                    optimizer.zero_grad()
+
+                with self.timer.phase('data'):
+                    batch_index = perm[batch_idx*local_batch_size:(batch_idx+1)*local_batch_size]
+                    batch_x_cat = x_cat_train[batch_index]
+                    batch_x_num = x_num_train[batch_index]
+                    batch_y_train = y_train[batch_index]
+
+                # sums the loss of every risk, time and proportion are the same for each risk
+                with autocast(self.precision, self.device_type):
+                    batch_loss = self.compute_loss(batch_x_cat, batch_x_num, batch_y_train)
+                with self.timer.phase('backward'):
+                    batch_loss.backward()
+                    if self.world_size > 1:
+                        all_reduce_gradients(self.model, self.world_size)
+                with self.timer.phase('optimizer'):
+                    optimizer.step()
+                self.profiler.step()
                 epoch_loss += batch_loss.item()
 
+                # validation every val_every_steps optimizer steps, patience counts validation checks
+                if val_set is not None and self.val_every_steps > 0 \
+                        and (epoch*num_train_batch + batch_idx + 1) % self.val_every_steps == 0:
+                    was_training = self.model.training
+                    if self.validation_check(epoch, epoch_loss / (batch_idx+1), (tensor_val, tensor_y_val), val_batch_size, val_loss_list):
+                        self.stop_early(epoch)
+                        return train_loss_list, val_loss_list, epoch+1
+                    self.model.train(was_training)
+
             train_loss_list.append(epoch_loss / (batch_idx+1))
-            if val_set is not None:
-                self.model.eval()
-                val_loss = 0
-                with torch.no_grad():
-                    for risk in range(self.model.config.num_event):
-                        phi_val = self.model.predict(tensor_val, val_batch_size, event=risk)
-                        # try NLLPCHazardLoss else NLLLogistiHazardLoss
-                        try:
-                            val_loss += self.metrics[0](phi_val, tensor_y_val["risk_{}".format(risk)][:,0].long(), tensor_y_val["risk_{}".format(risk)][:,1].long(), tensor_y_val["risk_{}".format(risk)][:,2].float())
-                        except:
-                            val_loss += self.metrics[0](phi_val, tensor_y_val["risk_{}".format(risk)][:,0].long(), tensor_y_val["risk_{}".format(risk)][:,1].long())
-
-                print("[Train-{}]: {}".format(epoch, epoch_loss / (batch_idx+1)))
-                print("[Val-{}]: {}".format(epoch, val_loss.item()))
-                val_loss_list.append(val_loss.item())
-                self.early_stopping(val_loss.item(), self.model, name=self.ckpt)
-                if self.early_stopping.early_stop:
-                    print(f"early stops at epoch {epoch+1}")
-                    # load best checkpoint
-                    self.model.load_state_dict(torch.load(self.ckpt))
+            if val_set is not None and self.val_every_steps <= 0 and (epoch+1) % self.val_every == 0:
+                # validation and checkpointing run on the main worker, which decides when every worker stops
+                if self.validation_check(epoch, epoch_loss / (batch_idx+1), (tensor_val, tensor_y_val), val_batch_size, val_loss_list):
+                    self.stop_early(epoch)
                     return train_loss_list, val_loss_list, epoch+1
-            else:
+            elif self.rank == 0:
                 print("[Train-{}]: {}".format(epoch, epoch_loss))
 
-        return train_loss_list, val_loss_list, epoch+1
+            with self.timer.phase('checkpoint'):
+                self.save_training_state(epoch, optimizer, shuffler, train_loss_list, val_loss_list)
+            self.timer.end_epoch(self.train_logs)
+
+        self.profiler.stop()
+        self.finish_checkpoints()
+        return train_loss_list, val_loss_list, epochs
 
     def fit(self,
         train_set,
@@ -523,15 +1110,34 @@ class Trainer:
         learning_rate=1e-3,
         weight_decay=0,
         val_batch_size=None,
+        resume_from=None,
         **kwargs,
         ):
         '''fit on the train_set, validate on val_set for early stop
+        train_set and val_set are (features, df_y) where features is a dataframe of features
+        or a prebuilt (x_cat int64, x_num float32) pair of arrays/tensors, see `utils.split_features`.
         params should have the following terms:
         batch_size,
         epochs,
         optimizer,
         metric,
+        with world_size > 1 the training runs in data-parallel worker processes, see `fit_distributed`.
+        resume_from is the path of a training state written by `save_training_state`,
+        training continues from the epoch after the one it was written at.
         '''
+        if self.world_size > 1 and not dist.is_initialized():
+            return self.fit_distributed(
+                    train_set=train_set,
+                    val_set=val_set,
+                    batch_size=batch_size,
+                    epochs=epochs,
+                    learning_rate=learning_rate,
+                    weight_decay=weight_decay,
+                    val_batch_size=val_batch_size,
+                    resume_from=resume_from,
+                    **kwargs,
+            )
+
         if self.model.config.num_event == 1:
             return self.train_single_event(
                     train_set=train_set,
@@ -541,6 +1147,7 @@ class Trainer:
                     learning_rate=learning_rate,
                     weight_decay=weight_decay,
                     val_batch_size=val_batch_size,
+                    resume_from=resume_from,
                     **kwargs,
             )
 
@@ -553,6 +1160,7 @@ class Trainer:
                     learning_rate=learning_rate,
                     weight_decay=weight_decay,
                     val_batch_size=val_batch_size,
+                    resume_from=resume_from,
                     **kwargs,
             )
 
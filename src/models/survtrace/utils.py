@@ -1,4 +1,5 @@
 import warnings
+import contextlib
 import numpy as np
 import torch
 import torch.nn.functional as F
@@ -107,6 +108,89 @@ def pad_col(input, val=0, where='end'):
         return torch.cat([pad, input], dim=1)
     raise ValueError(f"Need `where` to be 'start' or 'end', got {where}")
 
+PRECISIONS = ['fp32', 'bf16']
+
+def null_context():
+    """No-op context manager, `contextlib.nullcontext` needs python>=3.7."""
+    return contextlib.suppress()
+
+def autocast_enabled(device_type='cpu'):
+    """True inside an enabled autocast region of `device_type`."""
+    if device_type == 'cpu':
+        # cpu autocast was added in torch 1.10
+        return hasattr(torch, 'is_autocast_cpu_enabled') and torch.is_autocast_cpu_enabled()
+    return torch.is_autocast_enabled()
+
+def autocast(precision='fp32', device_type='cpu'):
+    """Mixed precision context of the `precision` policy.
+    'bf16' runs matmuls in bfloat16 with `torch.autocast` (torch>=1.10), 'fp32' is a no-op,
+    as is 'bf16' on torch versions without autocast.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"`precision` = {precision} is not valid. Use one of {PRECISIONS}.")
+    if precision == 'bf16' and hasattr(torch, 'autocast'):
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+    return null_context()
+
+def fp32_region(device_type='cpu'):
+    """Disables autocast, ops inside run in the dtype of their inputs."""
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type, enabled=False)
+    return null_context()
+
+def split_features(df, num_categorical_feature):
+    """Converts a dataframe of features once into the compact (x_cat int64, x_num float32) layout.
+    Categorical features must be ahead of numerical features, as done in `load_data`.
+
+    Returns:
+        tuple of contiguous numpy arrays -- (x_cat, x_num).
+    """
+    x_cat = np.ascontiguousarray(df.iloc[:, :num_categorical_feature].to_numpy(dtype='int64'))
+    x_num = np.ascontiguousarray(df.iloc[:, num_categorical_feature:].to_numpy(dtype='float32'))
+    return x_cat, x_num
+
+def to_model_inputs(x_input, num_categorical_feature):
+    """(x_cat, x_num) tensors for the survtrace models.
+
+    Arguments:
+        x_input -- a (x_cat, x_num) pair of numpy arrays or tensors, a tensor of features or a
+            dataframe of features. Arrays already in int64/float32 are wrapped without copying.
+        num_categorical_feature {int} -- number of categorical features.
+
+    Returns:
+        tuple of tensors -- (x_cat long, x_num float).
+    """
+    if isinstance(x_input, (tuple, list)):
+        x_cat, x_num = x_input
+        if isinstance(x_cat, np.ndarray):
+            x_cat = torch.from_numpy(x_cat)
+        if isinstance(x_num, np.ndarray):
+            x_num = torch.from_numpy(x_num)
+        return x_cat.long(), x_num.float()
+    if not isinstance(x_input, torch.Tensor):
+        x_cat, x_num = split_features(x_input, num_categorical_feature)
+        return torch.from_numpy(x_cat), torch.from_numpy(x_num)
+    return x_input[:, :num_categorical_feature].long(), x_input[:, num_categorical_feature:].float()
+
+def pack_labels(df_y, num_event=1):
+    """Packs the training labels into one contiguous float32 tensor.
+
+    Arguments:
+        df_y {pd.DataFrame} -- labels with 'duration', 'proportion' and 'event' (single event)
+            or 'event_{i}' (competing events) columns.
+        num_event {int} -- number of competing events.
+
+    Returns:
+        torch.tensor -- [N, 3] with columns (duration, event, proportion) for a single event,
+            [N, num_event, 3] with the event indicator of each risk for competing events.
+    """
+    if num_event == 1:
+        labels = df_y[['duration', 'event', 'proportion']].to_numpy(dtype='float32')
+    else:
+        labels = np.stack([df_y[['duration', 'event_{}'.format(risk), 'proportion']].to_numpy(dtype='float32')
+            for risk in range(num_event)], axis=1)
+    return torch.from_numpy(np.ascontiguousarray(labels))
+
 def array_or_tensor(tensor, numpy, input):
     warnings.warn('Use `torchtuples.utils.array_or_tensor` instead', DeprecationWarning)
     return tt.utils.array_or_tensor(tensor, numpy, input)
@@ -13,6 +13,11 @@ ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 RESULTS_DIR = os.path.join(ROOT_DIR, 'results')
 AUTHOR_RESULTS_PATH = os.path.join(ROOT_DIR, 'data','external', 'author_results.csv')
 
+# total seconds of each training phase, recorded by the SurvTRACE trainer
+PHASE_TIMES = ['time_data', 'time_forward', 'time_loss', 'time_backward', 'time_optimizer',
+               'time_validation', 'time_checkpoint']
+COMP_REQS = ['train_time', 'epochs_trained', 'time_per_epoch'] + PHASE_TIMES
+
 
 # TODO: maybe export aggregated results either in this function or within main
 def aggregate_raw_data() -> pd.DataFrame:
@@ -31,6 +36,8 @@ def aggregate_raw_data() -> pd.DataFrame:
         - train_time: total training time
         - epochs_trained: number epochs trained for
         - time_per_epoch: training time per epoch (train_time / epochs_trained)
+        - time_{phase}: total training time of a phase (data, forward, loss, backward,
+            optimizer, validation, checkpoint), SurvTRACE only
 
     Naming of file:
     - w/o censoring:
@@ -61,6 +68,9 @@ def aggregate_raw_data() -> pd.DataFrame:
     '''
     df_list = []
     for file_name in os.listdir(RESULTS_DIR):
+        # skip subdirectories such as 'results/profiles'
+        if not os.path.isfile(os.path.join(RESULTS_DIR, file_name)):
+            continue
         with open(os.path.join(RESULTS_DIR, file_name), 'rb') as f:
             result = pickle.load(f)
         result = pd.DataFrame(result)
@@ -170,8 +180,7 @@ def subset_computational_requirements(df: pd.DataFrame) -> Tuple[pd.DataFrame, p
             - Tuple[0]: dataframe w/o computational requirements dataset.
             - Tuple[1]: dataframe w/ computational requirements dataset.
     '''
-    comp_reqs = ['train_time', 'epochs_trained', 'time_per_epoch']
-    mask = df['horizon'].isin(comp_reqs)
+    mask = df['horizon'].isin(COMP_REQS)
     return df[~mask], df[mask]
 
 
@@ -209,7 +218,7 @@ def order_comp_horizon(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         - df (pd.Dataframe): dataframe of results in long format with horizons ordered.
     '''
-    cat = CategoricalDtype(categories=["train_time", "epochs_trained", "time_per_epoch"], ordered=True)
+    cat = CategoricalDtype(categories=COMP_REQS, ordered=True)
     df['horizon'] = df['horizon'].astype(cat)
     return df
 
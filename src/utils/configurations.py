@@ -1,5 +1,7 @@
 from easydict import EasyDict
 
+from src.models.survtrace.config import TRAINING_OPTIONS
+
 # defines various parameters for each experiment and model.
 # Note: hyperparameters depend on each model and dataset
 # naming of each dictionary: '{model name}_{dataset name}'.
@@ -274,6 +276,7 @@ survtrace_metabric = EasyDict(
         'output_hidden_states': False, # no use 
         'tie_word_embeddings': True, # no use
         'pruned_heads': {}, # no use
+        **TRAINING_OPTIONS, # training and inference options, see src/models/survtrace/config.py
 
         # hyperparameters
         'batch_size': batch_size_metabric,
@@ -313,6 +316,7 @@ survtrace_support = EasyDict(
         'output_hidden_states': False, # no use 
         'tie_word_embeddings': True, # no use
         'pruned_heads': {}, # no use
+        **TRAINING_OPTIONS, # training and inference options, see src/models/survtrace/config.py
 
         # hyperparameters
         'batch_size': batch_size_support,
@@ -353,6 +357,7 @@ survtrace_seer = EasyDict(
         'output_hidden_states': False, # no use 
         'tie_word_embeddings': True, # no use
         'pruned_heads': {}, # no use
+        **TRAINING_OPTIONS, # training and inference options, see src/models/survtrace/config.py
         'val_batch_size': 10000,
 
         # hyperparameters
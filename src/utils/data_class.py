@@ -1,5 +1,6 @@
 from easydict import EasyDict
 import numpy as np
+import pandas as pd
 import pickle
 import os
 
@@ -7,26 +8,92 @@ from src.utils.utils import df_to_event_time_array
 
 ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..', '..'))
 DATA_DIR = os.path.join(ROOT_DIR, 'data/processed')
+# tables shared by every run of a dataset, written by src.data.make_datasets
+ENCODED_DIR = 'encoded'
+META_FILE = 'meta.pickle'
+
+class _MappedTable:
+    '''
+    Table stored as .npy arrays by src.data.make_datasets.save_encoded.
+    The arrays are memory-mapped, so opening the table is constant time, only the rows
+    that are read are loaded, and parallel workers share the page cache.
+    '''
+    def __init__(self, directory: str, blocks: list):
+        self.blocks = [(np.load(os.path.join(directory, f"{block['name']}.npy"), mmap_mode='r'),
+                        block['columns'], block['dtypes']) for block in blocks]
+        self.num_rows = len(self.blocks[0][0])
+
+    def rows(self, index=None) -> pd.DataFrame:
+        '''
+        Reads the rows at positions index (all rows if None) into a DataFrame indexed by position,
+        with the column dtypes recorded when the table was saved (the stored dtype for the features).
+        '''
+        if index is None:
+            index = np.arange(self.num_rows)
+        frames = [pd.DataFrame(array[index], columns=columns, index=index).astype(dtypes)
+                  for array, columns, dtypes in self.blocks]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, axis=1)
+
+class _Split:
+    '''
+    Rows of a run's split read from a shared table on first access, then cached on the instance.
+    A split of None reads the whole table. Assigning the attribute replaces the cached rows.
+    '''
+    def __init__(self, table: str, split: str = None):
+        self.table = table
+        self.split = split
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        index = obj.split_index[self.split] if self.split is not None else None
+        value = obj.tables[self.table].rows(index)
+        obj.__dict__[self.name] = value
+        return value
 
 class Data:
     '''
-    Loads pickle file of data sets for a run of a dataset and
+    Loads the encoded tables of a dataset and the split of a run and
     does additional post-processing depending on the model.
-    Downstream tasks can access data through this class.
+    Downstream tasks can access data through this class, the
+    training, validation and test sets are materialized when first used.
     '''
+    df = _Split('outcomes')
+    df_train = _Split('features', 'train')
+    df_val = _Split('features', 'val')
+    df_test = _Split('features', 'test')
+    df_y_train = _Split('labels', 'train')
+    df_y_val = _Split('labels', 'val')
+    df_y_test = _Split('labels_test', 'test')
 
     def __init__(self, config: EasyDict, dataset: str, run_num: int, censor_event=False):
 
         DATASET_DIR = os.path.join(DATA_DIR, dataset)
 
         # load data run
-        with open(os.path.join(DATASET_DIR, f'run_{run_num}.pickle'), 'rb') as f:
-            data_tuple = pickle.load(f)
-        self.df, self.df_train, self.df_y_train, self.df_test, self.df_y_test, self.df_val, self.df_y_val, config_data = data_tuple
+        run_file = os.path.join(DATASET_DIR, f'run_{run_num}.pickle')
+        split_file = os.path.join(DATASET_DIR, f'run_{run_num}.npz')
+        if not os.path.isfile(split_file) and os.path.isfile(run_file):
+            # runs made before the encoded tables were shared hold every split
+            with open(run_file, 'rb') as f:
+                data_tuple = pickle.load(f)
+            self.df, self.df_train, self.df_y_train, self.df_test, self.df_y_test, self.df_val, self.df_y_val, config_data = data_tuple
+        else:
+            encoded_dir = os.path.join(DATASET_DIR, ENCODED_DIR)
+            with open(os.path.join(encoded_dir, META_FILE), 'rb') as f:
+                meta = pickle.load(f)
+            self.tables = {name: _MappedTable(encoded_dir, blocks) for name, blocks in meta['tables'].items()}
+            config_data = meta['config']
+            with np.load(split_file) as split_index:
+                self.split_index = dict(split_index)
 
         # add values from data config to model config file
         for key, value in config_data.items():
             config[key] = value
+        config['run_num'] = run_num
 
         # additional post processing for models that are not SurvTRACE
         if not config.model.startswith('survtrace'):
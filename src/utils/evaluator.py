@@ -166,7 +166,7 @@ class EvaluatorSingle(EvaluatorBase):
             _ = self.model.model.compute_baseline_hazards()
             return 1 - self.model.model.predict_surv(self.x_eval)
         elif self.model_name.startswith('survtrace'):
-            return 1 - self.model.model.predict_surv(self.x_eval, batch_size=None).cpu()
+            return 1 - self.model.model.predict_surv(self.x_eval, batch_size='auto').cpu()
         else:
             return 1 - self.model.model.predict_surv(self.x_eval)
 
@@ -204,6 +204,7 @@ class EvaluatorCompeting(EvaluatorBase):
 
     Attributes:
         - num_event (int): number of competing events
+        - risk_all: cached risk of all events for SurvTRACE, computed in a single pass
     """
     def __init__(self, data: Data, model, config: EasyDict, test_set: bool=True):
         '''
@@ -217,6 +218,7 @@ class EvaluatorCompeting(EvaluatorBase):
         '''
         super().__init__(data, model, config, test_set=test_set)
         self.num_event = config.num_event
+        self.risk_all = None
 
     # TODO: move to baselinse.models
     #   ideally it would be nice to have a generic interface for calculating risk in utils.models
@@ -236,7 +238,10 @@ class EvaluatorCompeting(EvaluatorBase):
         elif self.model_name == 'DeepHit':
             return self.model.model.predict_cif(self.x_eval)[event_idx, :, :].transpose()
         elif self.model_name.startswith('survtrace'):
-            return 1 - self.model.model.predict_surv(self.x_eval, batch_size=10000, event=event_idx).cpu()
+            # all events are scored with one encoder pass and reused for each event_idx
+            if self.risk_all is None:
+                self.risk_all = 1 - self.model.model.predict_surv_all(self.x_eval, batch_size=10000).cpu()
+            return self.risk_all[:, event_idx]
         else:
             raise('Model not implemented')
 
@@ -1,6 +1,7 @@
 # provides consistent interface to instantiate and train each model used in the experiments
 
 from abc import ABC, abstractclassmethod
+from typing import Optional
 from easydict import EasyDict
 import numpy as np
 import torchtuples as tt
@@ -27,11 +28,13 @@ class BaseModel(ABC):
 
     Attributes:
         - epochs_trained (int): number of epochs model trained for
+        - phase_times (dict): total seconds per training phase, e.g. {'time_forward': ...}, if the model records them
         - model: model from pycox, DSM, sksurv, or SurvTRACE.
         - eval_offset (int): number of columns to skip in model's risk calculation.
     '''
     def __init__(self):
         self.epochs_trained = 0
+        self.phase_times = {}
 
         # TODO: makes these abstract attributes
         self.model = None
@@ -400,23 +403,30 @@ class SurvTRACE(BaseModel):
             metrics_list = [NLLPCHazardLoss(), BCELoss(), MSELoss()]
 
         # initialize trainer
-        self.trainer = Trainer(self.model, metrics=metrics_list, gamma1=config.gamma1, gamma2=config.gamma2)
+        self.trainer = Trainer(self.model, metrics=metrics_list, gamma1=config.gamma1, gamma2=config.gamma2,
+                               compile_step=config.get('compile_step', False),
+                               world_size=config.get('world_size', 1))
 
 
-    def train(self, data: Data):
+    def train(self, data: Data, resume_from: Optional[str]=None):
         '''
         Trains self.model.
 
         Args:
             - data: Data class from utils.data_class
+            - resume_from (str): path of a training state written by the trainer, see config 'resume_every'
 
         Returns:
             Nothing.
             self.model is trained.
             Updates self.epochs_trained with total number of epochs from config.
+            Updates self.phase_times with the seconds of each training phase summed over epochs.
         '''
         train_loss, val_loss, last_epoch = self.trainer.fit((data.df_train, data.df_y_train),
                                                             (data.df_val, data.df_y_val),
+                                                            resume_from=resume_from,
                                                             **self.hyperparameters
                                                             )
-        self.epochs_trained = last_epoch
\ No newline at end of file
+        self.epochs_trained = last_epoch
+        self.phase_times = {key: float(np.sum(times)) for key, times in self.trainer.train_logs.items()
+                            if key.startswith('time_')}
\ No newline at end of file
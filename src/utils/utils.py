@@ -35,7 +35,8 @@ def export_results(results_list: List[Dict], config: EasyDict):
         pickle.dump(results_list, f)
 
 
-def update_run(run_dict:dict, train_time_start: float, train_time_finish: float, epochs_trained: int):
+def update_run(run_dict:dict, train_time_start: float, train_time_finish: float, epochs_trained: int,
+               phase_times: dict=None):
     """
     Adds computation stats of run to metrics dictionary.
 
@@ -43,12 +44,14 @@ def update_run(run_dict:dict, train_time_start: float, train_time_finish: float,
         - total training time
         - total epochs trained
         - time per epoch
+        - total time of each training phase, if recorded (e.g. 'time_forward')
 
     Args:
         run_dict (dict): dictionary of metrics returned from evaluator class
         train_time_start (float): time at start of training
         train_time_finish (float): time at end of training
         epochs_trained (int): number of epochs trained
+        phase_times (dict): total seconds of each training phase, keyed 'time_{phase}'
 
     Returns:
         A dictionary of results with a dictionary of metrics, total training time, number of
@@ -57,6 +60,8 @@ def update_run(run_dict:dict, train_time_start: float, train_time_finish: float,
     run_dict['train_time'] = train_time_finish - train_time_start
     run_dict['epochs_trained'] = epochs_trained
     run_dict['time_per_epoch'] =  run_dict['train_time'] / run_dict['epochs_trained']
+    if phase_times:
+        run_dict.update(phase_times)
     return run_dict
 
 
@@ -0,0 +1,46 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from src.models.survtrace.config import STConfig
+from src.models.survtrace.export import export_torchscript
+from src.models.survtrace.model import SurvTraceSingle, SurvTraceMulti
+
+
+def make_model(num_event):
+    '''survtrace model with random weights on the default config.'''
+    torch.manual_seed(0)
+    config = copy.deepcopy(STConfig)
+    config['num_event'] = num_event
+    config['duration_index'] = np.linspace(0, 1, config.out_feature + 1)
+    if num_event > 1:
+        return SurvTraceMulti(config, has_mtl=True).eval()
+    return SurvTraceSingle(config, has_mtl=True).eval()
+
+
+def make_inputs(config, num_sample=64):
+    x_cat = torch.randint(0, config.vocab_size, (num_sample, config.num_categorical_feature))
+    x_num = torch.randn(num_sample, config.num_numerical_feature)
+    return x_cat, x_num
+
+
+@pytest.mark.parametrize('num_event', [1, 2])
+def test_export_round_trip_matches_predict_surv(num_event, tmp_path):
+    model = make_model(num_event)
+    x_cat, x_num = make_inputs(model.config)
+    path = str(tmp_path / 'survtrace.ts')
+    export_torchscript(model, path=path)
+
+    module = torch.jit.load(path)
+    with torch.no_grad():
+        hazard, surv = module(x_cat, x_num)
+    if num_event > 1:
+        expected = model.predict_surv_all((x_cat, x_num)).cpu()
+    else:
+        expected = model.predict_surv((x_cat, x_num)).cpu()
+
+    assert surv.shape == expected.shape
+    assert torch.allclose(surv, expected, atol=1e-5)
+    assert torch.allclose(module.duration_index, torch.as_tensor(model.duration_index, dtype=torch.float32))
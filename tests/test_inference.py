@@ -0,0 +1,56 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from src.models.survtrace.config import STConfig
+from src.models.survtrace.inference import fold_batch_norm
+from src.models.survtrace.model import SurvTraceSingle, SurvTraceMulti
+
+
+def make_model(num_event):
+    '''survtrace model in eval mode with non-trivial BatchNorm statistics in its cls heads.'''
+    torch.manual_seed(0)
+    config = copy.deepcopy(STConfig)
+    config['num_event'] = num_event
+    config['duration_index'] = np.linspace(0, 1, config.out_feature + 1)
+    model = SurvTraceMulti(config, has_mtl=True) if num_event > 1 else SurvTraceSingle(config, has_mtl=True)
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm1d):
+                module.running_mean.normal_()
+                module.running_var.uniform_(0.5, 2.)
+                if module.affine:
+                    module.weight.normal_()
+                    module.bias.normal_()
+    return model.eval()
+
+
+@pytest.mark.parametrize('num_event', [1, 2])
+def test_fold_batch_norm_keeps_predictions(num_event):
+    model = make_model(num_event)
+    x_cat = torch.randint(0, model.config.vocab_size, (64, model.config.num_categorical_feature))
+    x_num = torch.randn(64, model.config.num_numerical_feature)
+    folded = fold_batch_norm(model)
+
+    assert not any(isinstance(module, nn.BatchNorm1d) for module in folded.cls.modules())
+    if num_event > 1:
+        expected = model.predict((x_cat, x_num), event=None)
+        output = folded.predict((x_cat, x_num), event=None)
+    else:
+        expected = model.predict((x_cat, x_num))
+        output = folded.predict((x_cat, x_num))
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_predict_cif_all_stacks_predict_cif():
+    model = make_model(num_event=2)
+    x_cat = torch.randint(0, model.config.vocab_size, (64, model.config.num_categorical_feature))
+    x_num = torch.randn(64, model.config.num_numerical_feature)
+
+    cif_all = model.predict_cif_all((x_cat, x_num))
+    expected = torch.stack([model.predict_cif((x_cat, x_num), event=e) for e in range(model.config.num_event)], dim=1)
+    assert cif_all.shape == (64, model.config.num_event, len(model.duration_index))
+    assert torch.allclose(cif_all, expected, atol=1e-6)
@@ -0,0 +1,69 @@
+import pytest
+import torch
+
+from src.models.survtrace.losses import nll_pc_hazard_loss, nll_pc_hazard_loss_fused
+from src.models.survtrace.losses import nll_logistic_hazard, nll_logistic_hazard_fused, NLLLogistiHazardLoss
+
+
+def make_pc_hazard_inputs(num_sample=16, num_event=None, num_durations=6, seed=0):
+    '''float64 logits, some below the log-softplus threshold, and labels with one dropped sample.
+    num_event=None gives [num_sample, T] logits, else stacked [num_sample, num_event, T] logits.'''
+    generator = torch.Generator().manual_seed(seed)
+    shape = (num_sample,) if num_event is None else (num_sample, num_event)
+    phi = (torch.randn(*shape, num_durations, generator=generator, dtype=torch.float64) * 8).requires_grad_()
+    idx_durations = torch.randint(0, num_durations, shape, generator=generator)
+    idx_durations[0] = -1
+    events = torch.randint(0, 2, shape, generator=generator)
+    interval_frac = torch.rand(shape, generator=generator, dtype=torch.float64)
+    return phi, idx_durations, events, interval_frac
+
+
+def reference_pc_hazard(phi, idx_durations, events, interval_frac):
+    '''sum over samples (and events) of the reference loss.'''
+    if phi.dim() == 2:
+        return nll_pc_hazard_loss(phi, idx_durations, events, interval_frac, 'sum')
+    return sum(nll_pc_hazard_loss(phi[:, event], idx_durations[:, event], events[:, event],
+                                  interval_frac[:, event], 'sum') for event in range(phi.shape[1]))
+
+
+@pytest.mark.parametrize('num_event', [None, 2])
+def test_pc_hazard_fused_gradcheck(num_event):
+    phi, idx_durations, events, interval_frac = make_pc_hazard_inputs(num_event=num_event)
+    assert torch.autograd.gradcheck(
+        lambda phi: nll_pc_hazard_loss_fused(phi, idx_durations, events, interval_frac, 'none'), (phi,))
+
+
+@pytest.mark.parametrize('num_event', [None, 2])
+def test_pc_hazard_fused_matches_reference(num_event):
+    phi, idx_durations, events, interval_frac = make_pc_hazard_inputs(num_event=num_event)
+    fused = nll_pc_hazard_loss_fused(phi, idx_durations, events, interval_frac, 'sum')
+    grad_fused, = torch.autograd.grad(fused, phi)
+    reference = reference_pc_hazard(phi, idx_durations, events, interval_frac)
+    grad_reference, = torch.autograd.grad(reference, phi)
+    assert torch.allclose(fused, reference)
+    assert torch.allclose(grad_fused, grad_reference)
+
+
+@pytest.mark.parametrize('num_event', [None, 2])
+def test_logistic_hazard_fused_matches_reference(num_event):
+    # more durations than events, so the time axis cannot be confused with the event axis
+    phi, idx_durations, events, _ = make_pc_hazard_inputs(num_event=num_event, num_durations=4)
+    idx_durations = idx_durations.clamp(min=0)
+    fused = nll_logistic_hazard_fused(phi, idx_durations, events, 'sum')
+    grad_fused, = torch.autograd.grad(fused, phi)
+    if num_event is None:
+        reference = nll_logistic_hazard(phi, idx_durations, events, 'sum')
+    else:
+        reference = sum(nll_logistic_hazard(phi[:, event], idx_durations[:, event], events[:, event], 'sum')
+                        for event in range(num_event))
+    grad_reference, = torch.autograd.grad(reference, phi)
+    assert torch.allclose(fused, reference)
+    assert torch.allclose(grad_fused, grad_reference)
+
+
+def test_logistic_hazard_stacked_loss_module():
+    phi, idx_durations, events, _ = make_pc_hazard_inputs(num_event=2, num_durations=4)
+    idx_durations = idx_durations.clamp(min=0)
+    stacked = NLLLogistiHazardLoss()(phi, idx_durations, events)
+    per_event = NLLLogistiHazardLoss(fused=False)(phi, idx_durations, events)
+    assert torch.allclose(stacked, per_event)
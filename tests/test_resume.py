@@ -0,0 +1,64 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+
+from src.models.survtrace.config import STConfig
+from src.models.survtrace.model import SurvTraceSingle, SurvTraceMulti
+from src.models.survtrace.train_utils import Trainer
+
+
+def make_model(num_event, checkpoint, resume_every=0):
+    '''survtrace model with dropout, so the train/eval mode of every epoch matters.'''
+    config = copy.deepcopy(STConfig)
+    config.update({
+        'num_event': num_event,
+        'duration_index': np.linspace(0, 1, STConfig.out_feature + 1),
+        'hidden_dropout_prob': 0.1,
+        'checkpoint': checkpoint,
+        'early_stop_patience': 100,
+        'resume_every': resume_every,
+    })
+    if num_event > 1:
+        return SurvTraceMulti(config, has_mtl=False)
+    return SurvTraceSingle(config, has_mtl=False)
+
+
+def make_set(config, num_sample, seed):
+    '''(x_cat, x_num) arrays and labels in the layout of Trainer.fit.'''
+    rng = np.random.RandomState(seed)
+    x_cat = rng.randint(0, config.vocab_size, (num_sample, config.num_categorical_feature)).astype('int64')
+    x_num = rng.randn(num_sample, config.num_numerical_feature).astype('float32')
+    df_y = pd.DataFrame({'duration': rng.randint(0, config.out_feature, num_sample).astype('float32'),
+                         'proportion': rng.rand(num_sample).astype('float32')})
+    event = rng.randint(0, config.num_event + 1, num_sample)
+    if config.num_event == 1:
+        df_y['event'] = (event == 1).astype('float32')
+    else:
+        for risk in range(config.num_event):
+            df_y[f'event_{risk}'] = (event == risk + 1).astype('float32')
+    return (x_cat, x_num), df_y
+
+
+def train(num_event, checkpoint, epochs, resume_every=0, resume_from=None, model_seed=0):
+    torch.manual_seed(model_seed)
+    np.random.seed(model_seed)
+    model = make_model(num_event, checkpoint, resume_every)
+    train_set, val_set = make_set(model.config, 256, seed=1), make_set(model.config, 64, seed=2)
+    trainer = Trainer(model)
+    trainer.fit(train_set, val_set, batch_size=32, epochs=epochs, learning_rate=1e-3, resume_from=resume_from)
+    return trainer
+
+
+@pytest.mark.parametrize('num_event', [1, 2])
+def test_resume_matches_uninterrupted_training(num_event, tmp_path):
+    uninterrupted = train(num_event, str(tmp_path / 'full.pt'), epochs=4)
+    interrupted = train(num_event, str(tmp_path / 'part.pt'), epochs=2, resume_every=1)
+    # the weights of the resumed model are overwritten by the training state
+    resumed = train(num_event, str(tmp_path / 'part.pt'), epochs=4, resume_from=interrupted.resume_ckpt, model_seed=1)
+
+    expected = uninterrupted.model.state_dict()
+    for key, value in resumed.model.state_dict().items():
+        assert torch.equal(value, expected[key]), key